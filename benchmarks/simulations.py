@@ -0,0 +1,239 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import matplotlib
+matplotlib.use("Agg")
+import numpy as np
+import scipy.io.wavfile as wav
+import checkpoint
+from reference_ful import ReferenceFul
+from reference_less import ReferenceLess
+from filtered import Filtered
+from output_sink import NullSink
+from controllers.lms import LMS
+from controllers.nlms import NLMS
+from controllers.rls import RLS
+
+# Simulation Benchmarks -
+#   - Throughput (samples/sec) and peak memory of controllers in every simulation type, across filter lengths and
+#     signal lengths, checked against a stored baseline
+#
+# The noise and reference signals are synthetic and generated from a fixed seed, so the benchmarks don't depend
+# on the sounds/ directory and every run processes the same samples. Nothing is plotted and no windows are opened.
+# Run from the repo root with:
+#
+#   python -m benchmarks.simulations                                  # run, and compare with the baseline if stored
+#   python -m benchmarks.simulations --save-baseline                  # store the results as the new baseline
+#   python -m benchmarks.simulations --user-controller my_module:MyController
+#   python -m benchmarks.simulations --warm-start benchmarks/warm        # start every controller converged
+#
+# A case regresses when its samples/sec drops more than --threshold (a fraction) below the baseline, in which
+# case the command exits with status 1.
+#
+# With --warm-start, every case's controller is seeded from a checkpoint of a converged controller in that
+# directory (see checkpoint.py), so the runs skip the convergence phase. Cases without a checkpoint are run once to
+# write one first.
+
+FS = 16000
+FILTER_SIZES = [4, 16, 64]
+NUM_SAMPLES = [5000, 20000]
+SCENARIOS = ["referenceful", "referenceless", "filtered"]
+CONTROLLERS = {"LMS": LMS, "NLMS": NLMS, "RLS": RLS}
+BASELINE_FILE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+# Write deterministic noise and reference wav files of num_samples samples to directory
+#   - noise: white noise through a first order low-pass filter, plus mains hum
+#   - reference: a few harmonic tones under a slow amplitude envelope, like a sustained chord
+def write_signals(directory, num_samples, fs=FS, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(num_samples) / fs
+
+    white = rng.normal(size=num_samples)
+    noise = np.empty(num_samples)
+    state = 0.0
+    for i in range(num_samples):
+        state = 0.9 * state + 0.1 * white[i]
+        noise[i] = state
+    noise += 0.05 * np.sin(2 * np.pi * 60 * t)
+
+    envelope = 0.6 + 0.4 * np.sin(2 * np.pi * 0.5 * t)
+    reference = envelope * sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate((220, 277, 330, 440), start=1))
+
+    file_paths = {}
+    for name, signal in (("noise", noise), ("reference", reference)):
+        file_paths[name] = os.path.join(directory, f"{name}-{num_samples}.wav")
+        wav.write(file_paths[name], fs, np.int16(signal / np.max(np.abs(signal)) * 32767))
+    return file_paths
+
+
+def build_simulation(scenario, controller, file_paths, num_samples, block_size):
+    if scenario == "referenceful":
+        return ReferenceFul(file_paths["noise"], file_paths["reference"], controller, num_samples, block_size)
+    if scenario == "referenceless":
+        return ReferenceLess(file_paths["noise"], controller, num_samples, block_size)
+    return Filtered(file_paths["noise"], controller, num_samples, block_size)
+
+
+# Load a user controller class from "module:ClassName"
+def load_controller(spec):
+    module_name, class_name = spec.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+# Wrap controller_factory so its controllers are warm-started from the case's checkpoint in directory, running the
+# case once to write the checkpoint if there is none
+def warm_factory(directory, case, scenario, controller_factory, file_paths, num_samples, block_size):
+    file_path = os.path.join(directory, case.replace("/", "-") + ".npz")
+    if not os.path.exists(file_path):
+        np.random.seed(0)
+        simulation = build_simulation(scenario, controller_factory(), file_paths, num_samples, block_size)
+        with contextlib.redirect_stdout(io.StringIO()):
+            simulation.simulate(sink=NullSink(), plot=False)
+        checkpoint.save_controller(simulation.controller, file_path)
+    return lambda: checkpoint.warm_start(controller_factory(), file_path)
+
+
+# Time one case, returning its result row
+#   - controller_factory: called with no arguments for a fresh controller on every repeat
+#   - warm_start: directory of converged controller checkpoints to start the controllers from, or None
+def run_case(scenario, controller_name, controller_factory, filter_size, file_paths, num_samples, block_size, repeat,
+             warm_start=None):
+    case = case_name(scenario, controller_name, filter_size, num_samples)
+    if warm_start is not None:
+        controller_factory = warm_factory(warm_start, case, scenario, controller_factory, file_paths, num_samples,
+                                          block_size)
+    seconds = []
+    for _ in range(repeat):
+        np.random.seed(0)
+        simulation = build_simulation(scenario, controller_factory(), file_paths, num_samples, block_size)
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_time = time.perf_counter()
+            simulation.simulate(sink=NullSink(), plot=False)
+            seconds.append(time.perf_counter() - start_time)
+
+    # Peak memory is measured on a separate run, since tracing allocations slows the run down
+    np.random.seed(0)
+    simulation = build_simulation(scenario, controller_factory(), file_paths, num_samples, block_size)
+    tracemalloc.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        simulation.simulate(sink=NullSink(), plot=False)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    best = min(seconds)
+    return {
+        "case": case,
+        "scenario": scenario,
+        "controller": controller_name,
+        "filter_size": filter_size,
+        "num_samples": num_samples,
+        "block_size": block_size,
+        "seconds": best,
+        "samples_per_second": num_samples / best if best > 0 else float("inf"),
+        "peak_memory_bytes": peak_memory,
+        "mse": simulation.mse,
+        "warm_start": warm_start is not None,
+    }
+
+
+def case_name(scenario, controller_name, filter_size, num_samples):
+    return f"{scenario}/{controller_name}/{filter_size if filter_size is not None else '-'}/{num_samples}"
+
+
+# Run every case, printing the results as they finish
+def run_benchmarks(scenarios, controllers, user_controllers, filter_sizes, num_samples, block_size=1, repeat=3,
+                   warm_start=None):
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for n in num_samples:
+            file_paths = write_signals(directory, n)
+            for scenario in scenarios:
+                cases = [(name, lambda name=name, size=size: CONTROLLERS[name](name, filter_size=size), size)
+                         for name in controllers for size in filter_sizes]
+                # User controllers are built with their name only, since their parameters aren't known
+                cases += [(spec, lambda spec=spec: load_controller(spec)(spec), None) for spec in user_controllers]
+                for controller_name, controller_factory, filter_size in cases:
+                    result = run_case(scenario, controller_name, controller_factory, filter_size, file_paths, n,
+                                      block_size, repeat, warm_start)
+                    print_result(result)
+                    results.append(result)
+    return results
+
+
+def print_result(result):
+    print(f"{result['case']:<40} {result['samples_per_second']:>12.0f} samples/s {result['peak_memory_bytes'] / 1024:>10.1f} KiB")
+
+
+# Compare results with a baseline, returning the cases whose samples/sec dropped more than threshold below it
+def compare(results, baseline, threshold):
+    baseline_rows = {row["case"]: row for row in baseline["results"]}
+    regressions = []
+    print(f"\n{'case':<40} {'baseline':>12} {'current':>12} {'change':>8}")
+    for result in results:
+        row = baseline_rows.get(result["case"])
+        if row is None:
+            continue
+        change = result["samples_per_second"] / row["samples_per_second"] - 1
+        regressed = change < -threshold
+        if regressed:
+            regressions.append(result["case"])
+        print(f"{result['case']:<40} {row['samples_per_second']:>12.0f} {result['samples_per_second']:>12.0f} "
+              f"{change * 100:>7.1f}%{' REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark controllers in every simulation type")
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--controllers", nargs="+", default=list(CONTROLLERS), choices=list(CONTROLLERS))
+    parser.add_argument("--user-controller", action="append", default=[], metavar="MODULE:CLASS",
+                        help="user controller class, constructed with its name only (can be repeated)")
+    parser.add_argument("--filter-sizes", nargs="+", type=int, default=FILTER_SIZES)
+    parser.add_argument("--num-samples", nargs="+", type=int, default=NUM_SAMPLES)
+    parser.add_argument("--block-size", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="time every case this many times, keeping the best")
+    parser.add_argument("--baseline", default=BASELINE_FILE_PATH, help="baseline results to compare with")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed drop in samples/sec, as a fraction")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    parser.add_argument("--warm-start", metavar="DIRECTORY",
+                        help="start the controllers from converged checkpoints in this directory (written if missing)")
+    args = parser.parse_args(args)
+
+    results = run_benchmarks(args.scenarios, args.controllers, args.user_controller, args.filter_sizes,
+                             args.num_samples, args.block_size, args.repeat, args.warm_start)
+    report = {"python": sys.version.split()[0], "numpy": np.__version__, "results": results}
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"\nSaved baseline to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --save-baseline to store one")
+        return 0
+
+    with open(args.baseline) as baseline_file:
+        regressions = compare(results, json.load(baseline_file), args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} case(s) regressed by more than {args.threshold * 100:.0f}%")
+        return 1
+    print("\nNo regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+import timeit
+import numpy as np
+from controllers.tap_delay_line import TapDelayLine
+
+# Tap Delay Line Microbenchmark -
+#   - Per-sample cost of keeping a controller's history window up to date and reading it back
+#
+# Compares the np.append(...)[1:] update the controllers used to do against TapDelayLine.push() + view()
+# Run from the repo root with: python -m benchmarks.tap_delay_line
+
+FILTER_SIZES = [4, 8, 16, 32, 64, 128, 256, 512, 1024]
+NUM_SAMPLES = 20000
+
+
+# Old approach, reallocates and copies the whole window every sample
+def append_window(samples, filter_size):
+    history_window = np.zeros(filter_size)
+    w = np.ones(filter_size)
+    for sample in samples:
+        history_window = np.append(history_window, sample)
+        history_window = history_window[1:]
+        np.dot(w, history_window)
+
+
+# Circular buffer, constant cost update and zero-copy view
+def tap_delay_line(samples, filter_size):
+    history_window = TapDelayLine(filter_size)
+    w = np.ones(filter_size)
+    for sample in samples:
+        history_window.push(sample)
+        np.dot(w, history_window.view())
+
+
+def main():
+    samples = list(np.random.default_rng(0).normal(size=NUM_SAMPLES))
+
+    print(f"Per-sample cost of the history window update + filter dot product ({NUM_SAMPLES} samples)")
+    print(f"{'taps':>6} {'np.append (us)':>16} {'TapDelayLine (us)':>18} {'speedup':>9}")
+    for filter_size in FILTER_SIZES:
+        append_time = min(timeit.repeat(lambda: append_window(samples, filter_size), number=1, repeat=3))
+        tdl_time = min(timeit.repeat(lambda: tap_delay_line(samples, filter_size), number=1, repeat=3))
+        append_us = append_time / NUM_SAMPLES * 1e6
+        tdl_us = tdl_time / NUM_SAMPLES * 1e6
+        print(f"{filter_size:>6} {append_us:>16.3f} {tdl_us:>18.3f} {append_us / tdl_us:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import os
+import time
+import numpy as np
+
+# Checkpoints -
+#   - Saves the state of a running simulation (controller, plant, monitor and output so far) to a .npz file, so a
+#     long simulation that crashes or is interrupted can be resumed from where it was, and pre-converged controllers
+#     can be reused to warm-start later runs
+#
+# The state of an object is every number and NumPy array among its attributes, found recursively through the objects
+# and lists it holds (e.g. a controller's weights, its TapDelayLine, its padasip filter and the adaptation state of
+# its filter), as a flat dict of arrays keyed by attribute path ("history_window.buffer"). Strings, None, functions
+# and classes are treated as configuration and left out, and objects can leave attributes out with __getstate__
+# (like MultichannelController does with its thread pool). Restoring a state writes the values back into an object
+# built the same way, i.e. with the same constructor arguments.
+#
+# Checkpoint files are written with np.savez_compressed (no pickled objects) to a temporary file first, which then
+# replaces the previous checkpoint, so an interrupted write never leaves a broken checkpoint behind. Their keys are
+# the state of every part of the simulation, prefixed with "controller/", "plant/", "monitor/" and "sink/", and the
+# simulation's own details under "simulation/". The output signal is not part of the checkpoints: the sinks keep it in
+# their own files and only record how many samples of them belong to the checkpoint (see output_sink.py).
+
+
+# State of obj, as a dict of arrays keyed by attribute path
+def object_state(obj):
+    state = {}
+    for name, value in attributes(obj).items():
+        add_state(state, name, value)
+    return state
+
+
+# Attributes of an object that make up its state
+def attributes(obj):
+    state = obj.__getstate__() if hasattr(obj, "__getstate__") else vars(obj)
+    return state if isinstance(state, dict) else {}
+
+
+def add_state(state, key, value):
+    if isinstance(value, (bool, int, float, complex, np.number, np.bool_, np.ndarray)):
+        state[key] = np.array(value)
+    elif isinstance(value, list):
+        state[f"{key}.__len__"] = np.array(len(value))
+        for i, item in enumerate(value):
+            add_state(state, f"{key}.{i}", item)
+    elif hasattr(value, "__dict__") and not callable(value):
+        for name, item in attributes(value).items():
+            add_state(state, f"{key}.{name}", item)
+
+
+# Write a state (from object_state()) back into obj, which has to be built like the object the state was taken from
+def restore_object_state(obj, state):
+    # Lists are resized before their items are restored
+    keys = sorted(state, key=lambda key: (not key.endswith(".__len__"), key.count("."), key))
+    for key in keys:
+        path = key.split(".")
+        try:
+            parent = obj
+            for name in path[:-1]:
+                parent = parent[int(name)] if isinstance(parent, list) else getattr(parent, name)
+            set_value(parent, path[-1], state[key])
+        except (AttributeError, IndexError, TypeError, ValueError) as error:
+            raise ValueError(f"State does not match {type(obj).__name__} at {key}: {error}") from error
+
+
+def set_value(parent, name, value):
+    if name == "__len__":
+        if len(parent) != int(value):
+            parent[:] = [None] * int(value)
+        return
+
+    current = parent[int(name)] if isinstance(parent, list) else getattr(parent, name)
+    if isinstance(current, np.ndarray):
+        if current.shape != value.shape:
+            raise ValueError(f"shape {value.shape}, expected {current.shape}")
+        # Arrays are updated in place, so views of them stay valid
+        if current.flags.writeable and current.dtype == value.dtype:
+            current[...] = value
+            return
+    if value.ndim == 0 and not isinstance(current, np.ndarray):
+        value = value.item()
+    if isinstance(parent, list):
+        parent[int(name)] = value
+    else:
+        setattr(parent, name, value)
+
+
+# States of several parts, with their keys prefixed by the part's name
+def combine(**parts):
+    return {f"{part}/{key}": value for part, state in parts.items() for key, value in state.items()}
+
+
+# State of one part of a combined state
+def part(state, name):
+    prefix = f"{name}/"
+    return {key[len(prefix):]: value for key, value in state.items() if key.startswith(prefix)}
+
+
+def save(file_path, state):
+    directory = os.path.dirname(os.path.abspath(file_path))
+    os.makedirs(directory, exist_ok=True)
+    temporary_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as checkpoint_file:
+        np.savez_compressed(checkpoint_file, **state)
+    os.replace(temporary_path, file_path)
+
+
+def load(file_path):
+    with np.load(file_path, allow_pickle=False) as checkpoint_file:
+        return {key: checkpoint_file[key] for key in checkpoint_file.files}
+
+
+# Save only the state of a controller, e.g. once it has converged, to warm-start other runs with
+def save_controller(controller, file_path):
+    save(file_path, combine(controller=controller.get_state()))
+
+
+# Seed a controller with the controller state of a checkpoint (a simulation checkpoint, or one written by
+# save_controller()), so it starts out converged. The controller has to be built like the checkpoint's controller
+def warm_start(controller, file_path):
+    state = part(load(file_path), "controller")
+    if not state:
+        raise ValueError(f"No controller state in {file_path}")
+    controller.set_state(state)
+    return controller
+
+
+# Writes the checkpoints of a simulation (see SimulationCore.simulate())
+#   - interval: seconds between checkpoints. A checkpoint is written after the first block that ends once interval
+#     seconds have passed since the last one, and after the last block
+class Checkpointer:
+
+    # Constructor
+    def __init__(self, file_path, interval=60.0):
+        self.file_path = file_path
+        self.interval = interval
+        self.last_time = time.perf_counter()
+
+    # Whether a checkpoint is due
+    def due(self):
+        return time.perf_counter() - self.last_time >= self.interval
+
+    def write(self, state):
+        save(self.file_path, state)
+        self.last_time = time.perf_counter()
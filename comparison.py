@@ -0,0 +1,122 @@
+import csv
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from reference_ful import ReferenceFul
+from reference_less import ReferenceLess
+from filtered import Filtered
+from output_sink import WavSink
+from sweep import find_peaks
+
+# Comparison Runner -
+#   - Runs every controller against every scenario, spread over a pool of worker processes
+#
+# Controllers are given as factories (anything picklable that returns a new Controller when called, e.g. the
+# controller class itself or functools.partial(LMS, "LMS Controller")), so every run gets its own fresh controller
+# instead of sharing one between simulations. Wav files are memory-mapped by every worker (so the operating system
+# shares them between processes instead of copying them into each one), and their normalization peaks are found
+# once up front and handed to the workers. Every run writes its error microphone signal to its own wav file under
+# output_dir/<scenario>/, and the MSE, attenuation, liveness and timing of every run are collected into one table.
+
+SIMULATIONS = {
+    "referenceful": ReferenceFul,
+    "referenceless": ReferenceLess,
+    "filtered": Filtered,
+}
+
+
+# Scenario - one simulation type run over one noise (and reference) recording
+class Scenario:
+
+    # Constructor
+    #   - simulation: "referenceful", "referenceless" or "filtered"
+    #   - reference_file_path: only used by Referenceful simulations
+    #   - cache: SignalCache (or True for the default one) to load the wav files from, see signal_cache.py
+    def __init__(self, name, simulation, noise_file_path, reference_file_path=None, num_timesteps=400000, block_size=1,
+                 cache=None):
+        if simulation not in SIMULATIONS:
+            raise ValueError(f"Unknown simulation {simulation}, expected one of {list(SIMULATIONS)}")
+        if simulation == "referenceful" and reference_file_path is None:
+            raise ValueError("Referenceful simulations need a reference_file_path")
+        self.name = name
+        self.simulation = simulation
+        self.noise_file_path = noise_file_path
+        self.reference_file_path = reference_file_path
+        self.num_timesteps = num_timesteps
+        self.block_size = block_size
+        self.cache = cache
+
+    # Build the simulation for a controller, using already known normalization peaks
+    def build(self, controller, peaks):
+        if self.simulation == "referenceful":
+            return ReferenceFul(self.noise_file_path, self.reference_file_path, controller, self.num_timesteps,
+                                self.block_size, noise_peak=peaks[self.noise_file_path],
+                                reference_peak=peaks[self.reference_file_path], cache=self.cache)
+        return SIMULATIONS[self.simulation](self.noise_file_path, controller, self.num_timesteps, self.block_size,
+                                            peak=peaks[self.noise_file_path], cache=self.cache)
+
+
+# Name that can safely be used as a file name
+def file_name(name):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_")
+
+
+# Run one controller against one scenario, in a worker process
+def run(scenario, controller_factory, peaks, output_dir, run_index):
+    controller = controller_factory()
+    simulation = scenario.build(controller, peaks)
+
+    scenario_dir = os.path.join(output_dir, file_name(scenario.name))
+    os.makedirs(scenario_dir, exist_ok=True)
+    output_file_path = os.path.join(scenario_dir, f"{run_index}_{file_name(controller.name)}.wav")
+
+    start_time = time.perf_counter()
+    simulation.simulate(new_controller=controller, sink=WavSink(output_file_path), plot=False)
+    seconds = time.perf_counter() - start_time
+
+    return {
+        "scenario": scenario.name,
+        "simulation": scenario.simulation,
+        "controller": controller.name,
+        "mse": simulation.mse,
+        "attenuation_db": simulation.attenuation_db,
+        "liveness": simulation.liveness_is_satisfied,
+        "seconds": seconds,
+        "samples_per_second": simulation.n / seconds if seconds > 0 else float("inf"),
+        "output": output_file_path,
+    }
+
+
+# Run every controller factory against every scenario in parallel, returning one result row per run
+#   - processes: number of worker processes, defaults to the number of CPUs
+# The table is also written to output_dir/results.csv
+def compare(controller_factories, scenarios, output_dir="comparison", processes=None):
+    # Find the normalization peak of every wav file once, instead of once per run
+    peaks = find_peaks(scenarios)
+
+    os.makedirs(output_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = []
+        for scenario in scenarios:
+            for run_index, controller_factory in enumerate(controller_factories):
+                futures.append(executor.submit(run, scenario, controller_factory, peaks, output_dir, run_index))
+        results = [future.result() for future in futures]
+
+    write_results(results, os.path.join(output_dir, "results.csv"))
+    return results
+
+
+def write_results(results, file_path):
+    with open(file_path, "w", newline="") as results_file:
+        writer = csv.DictWriter(results_file, fieldnames=list(results[0].keys()) if results else [])
+        writer.writeheader()
+        writer.writerows(results)
+
+
+# Print the result rows as a table
+def print_results(results):
+    print(f"{'scenario':<20} {'simulation':<14} {'controller':<20} {'mse':>12} {'atten (dB)':>10} {'liveness':>9} {'seconds':>9} {'samples/s':>12}")
+    for result in results:
+        print(f"{result['scenario']:<20} {result['simulation']:<14} {result['controller']:<20} {result['mse']:>12.6g} {result['attenuation_db']:>10.2f} "
+              f"{str(result['liveness']):>9} {result['seconds']:>9.3f} {result['samples_per_second']:>12.0f}")
@@ -1,8 +1,11 @@
+import numpy as np
+import profiling
+import checkpoint
 from abc import ABC, abstractmethod
 
 # Base Controller Class -
 #   - Abstract Class that all Controllers must implement (Python does not have Abstract classes, so we use the abc library)
-# 
+#
 # Implements the Controller component that accepts two inputs:
 #   - Input 1:
 #       - Wav Data:
@@ -15,16 +18,81 @@ from abc import ABC, abstractmethod
 #   - Output 1:
 #       - Output Wav Data:
 #           * Discretized wav of signal the controller will play to cancel the input wav signal
+#
+# Controllers can also be driven a block (NumPy frame) of samples at a time through process_block().
+# The default implementation simply wraps input() and feed_forward(), so user controllers only
+# need to implement the per-sample methods, but controllers can override it with a vectorized version.
+#
+# A controller can declare with supports_vectorized() that process_block() gives the same results as processing
+# one sample at a time (up to floating point rounding) for any block size, e.g. because it does not adapt in that
+# feed forward mode, or because it runs the per-sample updates itself. Simulations then hand it large blocks at once.
+#
+# When the error microphone is not simply input + output (e.g. with an acoustic plant, see plant.py), Referenceless
+# simulations call process_block() without feedback and then feed the measured error microphone block back through
+# feed_forward_block().
+#
+# get_state() and set_state() save and restore the controller's state (weights, history windows and adaptation
+# state) as a dict of NumPy arrays, for checkpoints (see checkpoint.py). By default the state is every number and
+# array among the controller's attributes, found recursively, which covers controllers that keep their state in
+# NumPy arrays, TapDelayLines and filter objects. Controllers with state the default can't find can override both.
+
+# Feed forward modes of a simulation
+FEED_NONE = 0       # no feed forward step (Filtered)
+FEED_REFERENCE = 1  # the reference signal (Referenceful)
+FEED_ERROR = 2      # the error microphone signal, input + output (Referenceless)
+
 class Controller(ABC):
 
+    # Whether the controller handles the (samples, channels) blocks of multichannel simulations itself, otherwise
+    # simulations run a copy of it per channel (see controllers/multichannel.py)
+    multichannel = False
+
     # Constructor
     def __init__(self, name):
         self.name = name
-    
+
     @abstractmethod
     def input(self, wav_signal):
         pass
 
-    # Hybrid Controllers can implement this 
+    # Hybrid Controllers can implement this
     def feed_forward(self, reference_signal):
         pass
+
+    # Whether process_block() matches the per-sample results for any block size, given the feed forward mode
+    def supports_vectorized(self, feed):
+        return False
+
+    # Process a block of samples, returning the block of controller outputs
+    #   - x_block: block of input signal samples
+    #   - ref_block: block of reference samples to feed forward (Referenceful), or None
+    #   - feedback: if True, feed forward the error microphone signal (input + output) instead (Referenceless)
+    # When neither ref_block nor feedback is given, no feed forward step is taken (Filtered)
+    def process_block(self, x_block, ref_block=None, feedback=False):
+        # Time input() and feed_forward() separately when profiling (see profiling.py)
+        profiler = profiling.current()
+        controller_input = profiler.timed("controller.input", self.input)
+        feed_forward = profiler.timed("controller.feed_forward", self.feed_forward)
+
+        output_block = np.zeros(len(x_block))
+        for i in range(len(x_block)):
+            output_block[i] = controller_input(x_block[i])
+            if feedback:
+                feed_forward(x_block[i] + output_block[i])
+            elif ref_block is not None:
+                feed_forward(ref_block[i])
+        return output_block
+
+    # Feed forward a block of error microphone samples, measured after the last process_block() call
+    def feed_forward_block(self, error_block):
+        feed_forward = profiling.current().timed("controller.feed_forward", self.feed_forward)
+        for error in error_block:
+            feed_forward(error)
+
+    # State of the controller, as a dict of NumPy arrays
+    def get_state(self):
+        return checkpoint.object_state(self)
+
+    # Restore a state from get_state() of a controller built with the same parameters
+    def set_state(self, state):
+        checkpoint.restore_object_state(self, state)
@@ -0,0 +1,491 @@
+import numpy as np
+from controllers.controller import FEED_NONE, FEED_REFERENCE, FEED_ERROR
+
+# Numba is optional, without it the kernels run as plain NumPy loops
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Native Adaptive Filter Engine -
+#   - First-party LMS, NLMS and RLS filters that can run a whole signal (or block) in one loop
+#
+# The filters have the same predict()/adapt() interface (and the same update equations) as the
+# padasip filters the controllers use, so they can be swapped in with the controllers' engine="native"
+# flag. On top of that, run() processes a block of samples in a single kernel call: every sample
+# pushes the input into the controller's tap delay line, predicts the output and adapts the weights,
+# exactly like calling the controller's input() and feed_forward() for each sample.
+#
+# lms_run_batch() and rls_run_batch() run many filters of the same length over the same signal in one pass,
+# for example to compare parameter settings (see sweep.py).
+#
+# FTFFilter and QRRLSFilter are RLS filters without a padasip counterpart (see controllers/fast_rls.py): the fast
+# transversal filter updates in O(n) per sample instead of O(n^2), and the inverse QR-RLS filter propagates a square
+# root of the inverse correlation matrix with Givens rotations, which keeps it positive definite.
+#
+# When Numba is installed the kernels are compiled, otherwise they run as NumPy loops. The NumPy
+# kernels evaluate the exact same expressions as padasip, so they match it bit-for-bit. The compiled
+# kernels can differ from padasip by floating point rounding (check it with verify()), pass exact=True
+# to a filter to always use the NumPy kernels.
+
+NUMBA_AVAILABLE = numba is not None
+
+# What is fed forward to the filter after every sample of a block is one of FEED_NONE, FEED_REFERENCE
+# or FEED_ERROR (see controllers/controller.py)
+
+
+# Compile a kernel with Numba if it is available
+def _kernel(function):
+    if NUMBA_AVAILABLE:
+        # Without the GIL, so filters of different channels can run in parallel threads (see multichannel.py)
+        return numba.njit(cache=True, nogil=True)(function), function
+    return function, function
+
+
+# LMS/NLMS kernel - the controllers adapt against the newest input sample (previous_input),
+# so the update is applied elementwise with the scalar input
+def _lms_run(x, ref, feed, w, taps, position, mu, eps, normalized):
+    n = len(w)
+    output = np.empty(len(x))
+    for i in range(len(x)):
+        taps[position] = x[i]
+        taps[position + n] = x[i]
+        position = (position + 1) % n
+
+        output[i] = -1 * np.dot(w, taps[position:position + n])
+        if feed == FEED_NONE:
+            continue
+
+        d = ref[i] if feed == FEED_REFERENCE else x[i] + output[i]
+        if normalized:
+            step = mu / (eps + x[i] * x[i]) * x[i]
+        else:
+            step = mu * x[i]
+        w += step * (d - w * x[i])
+    return output, position
+
+
+# RLS kernel - mu is the forgetting factor and R the inverse of the input correlation matrix
+def _rls_run(x, ref, feed, w, R, taps, position, mu):
+    n = len(w)
+    output = np.empty(len(x))
+    for i in range(len(x)):
+        taps[position] = x[i]
+        taps[position + n] = x[i]
+        position = (position + 1) % n
+        window = taps[position:position + n]
+
+        output[i] = -1 * np.dot(w, window)
+        if feed == FEED_NONE:
+            continue
+
+        d = ref[i] if feed == FEED_REFERENCE else x[i] + output[i]
+        e = d - np.dot(w, window)
+        R1 = R @ np.outer(window, window) @ R
+        R2 = mu + np.dot(np.dot(window, R), window)
+        R = 1 / mu * (R - R1 / R2)
+        w += np.dot(R, window) * e
+    return output, R, position
+
+
+# Batched LMS/NLMS kernel - runs K filters of the same length over the same input at once, with one row of W
+# (and one entry of mu and eps) per filter. Returns the outputs of every filter, shape (K, len(x))
+def _lms_run_batch(x, ref, feed, W, taps, position, mu, eps, normalized):
+    K, n = W.shape
+    output = np.empty((K, len(x)))
+    for i in range(len(x)):
+        taps[position] = x[i]
+        taps[position + n] = x[i]
+        position = (position + 1) % n
+
+        y = -1 * (W @ taps[position:position + n])
+        output[:, i] = y
+        if feed == FEED_NONE:
+            continue
+
+        if feed == FEED_REFERENCE:
+            d = np.full(K, ref[i])
+        else:
+            d = x[i] + y
+        if normalized:
+            step = mu / (eps + x[i] * x[i]) * x[i]
+        else:
+            step = mu * x[i]
+        W += step.reshape(K, 1) * (d.reshape(K, 1) - W * x[i])
+    return output, position
+
+
+# Batched RLS kernel, looping over the filters (R has one inverse correlation matrix per filter, shape (K, n, n))
+def _rls_run_batch(x, ref, feed, W, R, taps, position, mu):
+    K, n = W.shape
+    output = np.empty((K, len(x)))
+    for i in range(len(x)):
+        taps[position] = x[i]
+        taps[position + n] = x[i]
+        position = (position + 1) % n
+        window = taps[position:position + n]
+
+        for k in range(K):
+            output[k, i] = -1 * np.dot(W[k], window)
+            if feed == FEED_NONE:
+                continue
+
+            d = ref[i] if feed == FEED_REFERENCE else x[i] + output[k, i]
+            Rx = R[k] @ window
+            R[k] = 1 / mu[k] * (R[k] - np.outer(Rx, Rx) / (mu[k] + np.dot(window, Rx)))
+            W[k] += (R[k] @ window) * (d + output[k, i])
+    return output, position
+
+
+# Batched RLS kernel vectorized over the filters with NumPy, used when Numba is not available
+def _rls_run_batch_numpy(x, ref, feed, W, R, taps, position, mu):
+    K, n = W.shape
+    output = np.empty((K, len(x)))
+    for i in range(len(x)):
+        taps[position] = x[i]
+        taps[position + n] = x[i]
+        position = (position + 1) % n
+        window = taps[position:position + n]
+
+        y = -1 * (W @ window)
+        output[:, i] = y
+        if feed == FEED_NONE:
+            continue
+
+        d = ref[i] if feed == FEED_REFERENCE else x[i] + y
+        Rx = R @ window
+        R[:] = (R - Rx[:, :, None] * Rx[:, None, :] / (mu + Rx @ window)[:, None, None]) / mu[:, None, None]
+        W += (R @ window) * (d + y)[:, None]
+    return output, position
+
+
+# Stabilized fast transversal filter (FTF) update for one desired sample, returning the a priori error
+#   - window: the newest n + 1 input samples, oldest first (the update also needs the sample that just left the
+#     filter's window)
+#   - a, b: forward and backward linear predictors, gain: normalized a priori Kalman gain
+#   - state: forward and backward prediction error energies, conversion factor, input energy, samples since the
+#     last rescue and number of rescues
+# The backward prediction error is both computed directly and derived from the gain, and the two are mixed to
+# feed back the numerical error (Slock & Kailath). When the conversion factor or the energies leave their valid
+# range, or every rescue_interval samples (if > 0), the predictors are rescued: they are restarted as if the input
+# correlation matrix were the input energy times the identity, while the filter weights are kept.
+# Started from the state of FTFFilter, the updates are exactly those of RLS with the initial correlation matrix
+# eps * diag(1, 1 / mu, ..., 1 / mu^(n - 1)) (newest tap first) and zero samples before the first one, rather than
+# the eps * I of the RLS controller. The difference fades as mu^t.
+def _ftf_adapt(window, d, w, a, b, gain, state, mu, eps, rescue_interval):
+    n = len(w)
+    previous = window[:n]
+    current = window[1:]
+    alpha, beta, gamma = state[0], state[1], state[2]
+    state[3] = mu * state[3] + window[n] * window[n]
+
+    # Forward prediction, and the gain extended to n + 1 taps
+    e_f = window[n] - np.dot(a, previous)
+    scale = e_f / (mu * alpha)
+    extended_gain = np.empty(n + 1)
+    extended_gain[:n] = gain - scale * a
+    extended_gain[n] = scale
+    a += gain * (gamma * e_f)
+    alpha_next = mu * alpha + gamma * e_f * e_f
+    gamma_extended = gamma * mu * alpha / alpha_next
+
+    # Backward prediction
+    m = extended_gain[0]
+    e_b_gain = mu * beta * m
+    e_b_direct = window[0] - np.dot(b, current)
+    e_b_update = 1.5 * e_b_direct - 0.5 * e_b_gain
+    gain[:] = extended_gain[1:] + m * b
+    gamma = 1 / (1 / gamma_extended - e_b_direct * e_b_direct / (mu * beta))
+    beta_next = mu * beta + gamma * e_b_update * e_b_update
+    b += gain * (gamma * e_b_update)
+
+    state[4] += 1
+    if not (0 < gamma <= 1 and alpha_next > 0 and beta_next > 0) or (0 < rescue_interval <= state[4]):
+        energy = state[3] + eps
+        a[:] = 0
+        b[:] = 0
+        gain[:] = current / (mu * energy)
+        alpha_next = beta_next = energy
+        gamma = 1 / (1 + np.dot(current, current) / (mu * energy))
+        state[4] = 0
+        state[5] += 1
+    state[0], state[1], state[2] = alpha_next, beta_next, gamma
+
+    # Filter weights
+    e = d - np.dot(w, current)
+    w += gain * (gamma * e)
+    return e
+
+
+# Inverse QR-RLS update for one desired sample, returning the a priori error
+#   - window: the newest n + 1 input samples, oldest first (only the newest n are used)
+#   - root: square root of the inverse correlation matrix P = root.T @ root
+# The rows of root, scaled by 1 / sqrt(mu), are rotated into [1, root @ x] one at a time, which leaves
+# [1 / sqrt(conversion factor), Kalman gain / sqrt(conversion factor)] and the updated square root.
+def _qr_rls_adapt(window, d, w, root, mu):
+    n = len(w)
+    current = window[1:]
+    e = d - np.dot(w, current)
+    root *= 1 / np.sqrt(mu)
+    projection = root @ current
+    top = 1.0
+    gain = np.zeros(n)
+    for j in range(n):
+        r = np.sqrt(top * top + projection[j] * projection[j])
+        if r == 0:
+            continue
+        c = top / r
+        s = projection[j] / r
+        for k in range(n):
+            value = root[j, k]
+            root[j, k] = c * value - s * gain[k]
+            gain[k] = c * gain[k] + s * value
+        top = r
+    w += gain * (e / top)
+    return e
+
+
+_lms_run_compiled, _lms_run_numpy = _kernel(_lms_run)
+_rls_run_compiled, _rls_run_numpy = _kernel(_rls_run)
+lms_run_batch, _ = _kernel(_lms_run_batch)
+rls_run_batch = _kernel(_rls_run_batch)[0] if NUMBA_AVAILABLE else _rls_run_batch_numpy
+ftf_adapt, _ = _kernel(_ftf_adapt)
+qr_rls_adapt, _ = _kernel(_qr_rls_adapt)
+
+
+# Fast RLS kernel - runs ftf_adapt() (method 0) or qr_rls_adapt() (method 1) after every sample of a block, with a
+# tap delay line of n + 1 samples. The state arrays of the other method are ignored
+def _fast_rls_run(x, ref, feed, method, w, a, b, gain, state, root, taps, position, mu, eps, rescue_interval):
+    n = len(w)
+    output = np.empty(len(x))
+    for i in range(len(x)):
+        taps[position] = x[i]
+        taps[position + n + 1] = x[i]
+        position = (position + 1) % (n + 1)
+        window = taps[position:position + n + 1]
+
+        output[i] = -1 * np.dot(w, window[1:])
+        if feed == FEED_NONE:
+            continue
+
+        d = ref[i] if feed == FEED_REFERENCE else x[i] + output[i]
+        if method == 0:
+            ftf_adapt(window, d, w, a, b, gain, state, mu, eps, rescue_interval)
+        else:
+            qr_rls_adapt(window, d, w, root, mu)
+    return output, position
+
+
+fast_rls_run, _ = _kernel(_fast_rls_run)
+
+
+# Initial filter weights, generated the same way padasip does so seeded runs match
+def init_weights(w, n):
+    if isinstance(w, str):
+        if w == "random":
+            return np.random.normal(0, 0.5, n)
+        elif w == "zeros":
+            return np.zeros(n)
+        raise ValueError('Impossible to understand the w')
+    if len(w) != n:
+        raise ValueError('Impossible to understand the w')
+    return np.array(w, dtype="float64")
+
+
+# Per-sample LMS/NLMS updates over a block (the padasip engine's process_block()), where every update is
+# w + step * (d - x * w) with the scalar input x (see _lms_run). Every update scales the weights by 1 - step * x and
+# adds step * d to every weight, so the weights at every sample of the block are the starting weights scaled plus an
+# offset, and the outputs only need the dot products of the windows with the starting weights (one matrix product).
+# Returns the outputs and the weights after the block, the same as running the per-sample updates one by one
+#   - windows: the history window of every sample of the block, step: step size of every sample
+def block_lms_run(w, windows, x, ref, feed, step):
+    products = windows @ w
+    sums = windows.sum(axis=1)
+    output = np.empty(len(x))
+    scale, offset = 1.0, 0.0
+    for i in range(len(x)):
+        output[i] = -1 * (scale * products[i] + offset * sums[i])
+        d = ref[i] if feed == FEED_REFERENCE else x[i] + output[i]
+        decay = 1 - step[i] * x[i]
+        scale, offset = scale * decay, offset * decay + step[i] * d
+    return output, scale * w + offset
+
+
+# Feed forward mode of a process_block() call
+def feed_mode(ref_block, feedback):
+    if feedback:
+        return FEED_ERROR
+    if ref_block is not None:
+        return FEED_REFERENCE
+    return FEED_NONE
+
+
+class LMSFilter:
+
+    # Constructor
+    def __init__(self, n, mu=0.01, w="random", exact=False):
+        self.n = n
+        self.mu = mu
+        self.w = init_weights(w, n)
+        self.exact = exact
+
+    def predict(self, x):
+        return np.dot(self.w, x)
+
+    # Adapt weights according to one desired value and its input
+    def adapt(self, d, x):
+        e = d - self.predict(x)
+        self.w += self.learning_rule(e, x)
+
+    def learning_rule(self, e, x):
+        return self.mu * x * e
+
+    # Run a block through the controller's tap delay line, returning the controller outputs
+    def run(self, x_block, ref_block, feed, history_window):
+        x_block = np.ascontiguousarray(x_block, dtype=np.float64)
+        ref_block = x_block if ref_block is None else np.ascontiguousarray(ref_block, dtype=np.float64)
+        kernel = _lms_run_numpy if self.exact else _lms_run_compiled
+        output, history_window.position = kernel(x_block, ref_block, feed, self.w, history_window.buffer,
+                                                 history_window.position, self.mu, 0.0, False)
+        return output
+
+
+class NLMSFilter(LMSFilter):
+
+    # Constructor
+    def __init__(self, n, mu=0.1, eps=0.001, w="random", exact=False):
+        super().__init__(n, mu=mu, w=w, exact=exact)
+        self.eps = eps
+
+    def learning_rule(self, e, x):
+        return self.mu / (self.eps + np.dot(x, x)) * x * e
+
+    def run(self, x_block, ref_block, feed, history_window):
+        x_block = np.ascontiguousarray(x_block, dtype=np.float64)
+        ref_block = x_block if ref_block is None else np.ascontiguousarray(ref_block, dtype=np.float64)
+        kernel = _lms_run_numpy if self.exact else _lms_run_compiled
+        output, history_window.position = kernel(x_block, ref_block, feed, self.w, history_window.buffer,
+                                                 history_window.position, self.mu, self.eps, True)
+        return output
+
+
+class RLSFilter(LMSFilter):
+
+    # Constructor
+    def __init__(self, n, mu=0.99, eps=0.001, w="random", exact=False):
+        super().__init__(n, mu=mu, w=w, exact=exact)
+        self.eps = eps
+        self.R = 1 / self.eps * np.identity(n)
+
+    def learning_rule(self, e, x):
+        R1 = self.R @ (x[:, None] * x[None, :]) @ self.R
+        R2 = self.mu + np.dot(np.dot(x, self.R), x.T)
+        self.R = 1 / self.mu * (self.R - R1 / R2)
+        return np.dot(self.R, x.T) * e
+
+    def run(self, x_block, ref_block, feed, history_window):
+        x_block = np.ascontiguousarray(x_block, dtype=np.float64)
+        ref_block = x_block if ref_block is None else np.ascontiguousarray(ref_block, dtype=np.float64)
+        kernel = _rls_run_numpy if self.exact else _rls_run_compiled
+        output, self.R, history_window.position = kernel(x_block, ref_block, feed, self.w, self.R,
+                                                         history_window.buffer, history_window.position, self.mu)
+        return output
+
+
+# Fast transversal RLS filter (see _ftf_adapt()), O(n) per sample
+#   - mu: forgetting factor, at least 1 - 1 / (2 * n) for the update to stay stable between rescues
+#   - eps: initial prediction error energies (regularization, like the RLS filter's eps)
+#   - rescue_interval: rescue the predictors every rescue_interval samples, or only when they break down if 0
+class FTFFilter(LMSFilter):
+
+    # Constructor
+    def __init__(self, n, mu=0.999, eps=0.001, w="zeros", rescue_interval=0):
+        if mu < 1 - 1 / (2 * n):
+            raise ValueError(f"Forgetting factor {mu} is below 1 - 1 / (2 * {n}), the fast transversal filter would "
+                             f"be unstable (use a larger one, or the QR-RLS filter)")
+        super().__init__(n, mu=mu, w=w)
+        self.eps = eps
+        self.rescue_interval = rescue_interval
+        self.a = np.zeros(n)
+        self.b = np.zeros(n)
+        self.gain = np.zeros(n)
+        self.state = np.array([eps, eps * mu ** -n, 1.0, 0.0, 0.0, 0.0])
+
+    # Number of times the predictors were rescued
+    @property
+    def rescues(self):
+        return int(self.state[5])
+
+    # Adapt weights according to one desired value and the newest n + 1 input samples (oldest first)
+    def adapt(self, d, x):
+        ftf_adapt(np.ascontiguousarray(x, dtype=np.float64), d, self.w, self.a, self.b, self.gain, self.state,
+                  self.mu, self.eps, self.rescue_interval)
+
+    # Run a block through the controller's tap delay line (of n + 1 samples), returning the controller outputs
+    def run(self, x_block, ref_block, feed, history_window):
+        x_block = np.ascontiguousarray(x_block, dtype=np.float64)
+        ref_block = x_block if ref_block is None else np.ascontiguousarray(ref_block, dtype=np.float64)
+        output, history_window.position = fast_rls_run(x_block, ref_block, feed, 0, self.w, self.a, self.b, self.gain,
+                                                       self.state, np.zeros((0, 0)), history_window.buffer,
+                                                       history_window.position, self.mu, self.eps, self.rescue_interval)
+        return output
+
+
+# Inverse QR-RLS filter (see _qr_rls_adapt()), O(n^2) per sample like RLS, but numerically robust
+#   - mu: forgetting factor, eps: initialisation value of the inverse correlation matrix (P = I / eps)
+class QRRLSFilter(LMSFilter):
+
+    # Constructor
+    def __init__(self, n, mu=0.999, eps=0.001, w="zeros"):
+        super().__init__(n, mu=mu, w=w)
+        self.eps = eps
+        self.root = 1 / np.sqrt(self.eps) * np.identity(n)
+
+    # Inverse correlation matrix
+    @property
+    def R(self):
+        return self.root.T @ self.root
+
+    # Adapt weights according to one desired value and the newest n + 1 input samples (oldest first)
+    def adapt(self, d, x):
+        qr_rls_adapt(np.ascontiguousarray(x, dtype=np.float64), d, self.w, self.root, self.mu)
+
+    # Run a block through the controller's tap delay line (of n + 1 samples), returning the controller outputs
+    def run(self, x_block, ref_block, feed, history_window):
+        x_block = np.ascontiguousarray(x_block, dtype=np.float64)
+        ref_block = x_block if ref_block is None else np.ascontiguousarray(ref_block, dtype=np.float64)
+        empty = np.zeros(0)
+        output, history_window.position = fast_rls_run(x_block, ref_block, feed, 1, self.w, empty, empty, empty,
+                                                       np.zeros(6), self.root, history_window.buffer,
+                                                       history_window.position, self.mu, self.eps, 0)
+        return output
+
+
+# Check the native engine against padasip for one of the controllers, returning the largest
+# difference between their outputs. Raises a ValueError if it is larger than tolerance
+#   - controller_class: LMS, NLMS or RLS (or a subclass with the same constructor)
+#   - feedback / use_reference: feed forward mode to check, defaults to Referenceful
+def verify(controller_class, num_samples=10000, tolerance=0.0, exact=True, use_reference=True, feedback=False, seed=0):
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(-1, 1, num_samples)
+    ref = rng.uniform(-1, 1, num_samples) if use_reference else None
+
+    np.random.seed(seed)
+    padasip_controller = controller_class("padasip", engine="padasip")
+    np.random.seed(seed)
+    native_controller = controller_class("native", engine="native", exact=exact)
+
+    # The padasip engine is driven through the per-sample path
+    padasip_output = np.zeros(num_samples)
+    for i in range(num_samples):
+        padasip_output[i] = padasip_controller.input(x[i])
+        if feedback:
+            padasip_controller.feed_forward(x[i] + padasip_output[i])
+        elif ref is not None:
+            padasip_controller.feed_forward(ref[i])
+    native_output = native_controller.process_block(x, ref, feedback)
+
+    difference = np.max(np.abs(padasip_output - native_output))
+    if not difference <= tolerance:
+        raise ValueError(f"Native engine differs from padasip by {difference} for {controller_class.__name__} (tolerance {tolerance})")
+    return difference
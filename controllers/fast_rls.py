@@ -0,0 +1,60 @@
+import numpy as np
+from controllers.controller import Controller
+from controllers.tap_delay_line import TapDelayLine
+from controllers.engine import FTFFilter, QRRLSFilter, feed_mode
+
+# Fast RLS Controller -
+#   - RLS controller for long filters (64 - 256+ taps), where the RLS controller's O(n^2) update is too slow
+#
+# Two RLS filters from controllers/engine.py are available:
+#   - "ftf": a stabilized fast transversal filter, which solves the same exponentially weighted least squares problem
+#     as RLS with forward and backward linear predictors of the input in O(n) per sample. Rounding errors build up
+#     in the predictors over time, so they are rescued (restarted, keeping the filter weights) when they break
+#     down, and optionally every rescue_interval samples
+#   - "qr": an inverse QR-RLS filter, O(n^2) per sample like RLS, that propagates a square root of the inverse
+#     correlation matrix with Givens rotations, so it stays positive definite however long it runs
+#
+# Like the RLS controller, the value fed forward is the desired signal of the filter. Blocks are run through the
+# per-sample updates in a single (Numba compiled if available) loop, so process_block() of any block size gives the
+# per-sample results.
+class FastRLS(Controller):
+
+    # Constructor
+    #   - method: "ftf" or "qr"
+    #   - filter_size, mu, eps, w: filter length, forgetting factor, regularization and initial weights ("zeros",
+    #     "random" or an array). With "ftf", mu should be at least 1 - 1 / (2 * filter_size)
+    #   - rescue_interval: with "ftf", also rescue the predictors every rescue_interval samples (0 to only rescue
+    #     them when they break down)
+    def __init__(self, name, method="ftf", filter_size=64, mu=0.999, eps=0.001, w="zeros", rescue_interval=0):
+        super().__init__(name)
+        self.method = method
+        self.filter_size = filter_size
+        if method == "ftf":
+            self.rls_filter = FTFFilter(n=filter_size, mu=mu, eps=eps, w=w, rescue_interval=rescue_interval)
+        elif method == "qr":
+            self.rls_filter = QRRLSFilter(n=filter_size, mu=mu, eps=eps, w=w)
+        else:
+            raise ValueError(f"Unknown method {method}")
+
+        # The update also needs the sample that just left the filter's window, so one more sample is kept
+        self.history_window = TapDelayLine(self.filter_size + 1)
+
+    # Given wav_signal, create output signal to cancel input
+    def input(self, wav_signal):
+        self.history_window.push(wav_signal)
+
+        return -1 * self.rls_filter.predict(self.history_window.view()[1:])
+
+    # Update filter weights based on reference signal and the input window
+    def feed_forward(self, reference_signal):
+        self.rls_filter.adapt(reference_signal, self.history_window.view())
+
+    # The per-sample updates are run over the whole block
+    def supports_vectorized(self, feed):
+        return True
+
+    def process_block(self, x_block, ref_block=None, feedback=False):
+        x_block = np.asarray(x_block, dtype=float)
+        if len(x_block) == 0:
+            return np.zeros(0)
+        return self.rls_filter.run(x_block, ref_block, feed_mode(ref_block, feedback), self.history_window)
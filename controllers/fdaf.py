@@ -0,0 +1,147 @@
+import numpy as np
+from controllers.controller import Controller
+from plant import PartitionedConvolver
+
+# Frequency Domain Adaptive Filter (FDAF) Controller -
+#   - Block LMS filter for long (512 - 4096+ taps) responses, e.g. realistic room reverberation, that filters and
+#     adapts in the frequency domain with overlap-save FFTs
+#
+# The filter of filter_size taps is split into partitions of block_size taps (a multidelay filter, with a single
+# partition when block_size == filter_size this is the classic overlap-save FDAF). The output is the input convolved
+# with the filter by a PartitionedConvolver (see plant.py), so every sample is still answered right away, and the
+# weights are adapted once per block of block_size samples:
+#   - the errors of the block are correlated with the spectra of the input frames of every partition
+#   - every frequency bin is normalized by the (smoothed) power of the input in that bin, which makes the step
+#     size independent of the input's spectrum (normalized=True)
+#   - the gradient is constrained to block_size taps per partition, so the update is linear and not circular
+#
+# That costs O(block_size + (filter_size / block_size) * log(block_size)) per sample, instead of the O(filter_size)
+# of time domain LMS. Samples are buffered until the block is complete, so input() / feed_forward() and
+# process_block() of any block size give the same results.
+#
+# Like the LMS and NLMS controllers, the value fed forward is the desired signal of the filter, and the error is the
+# desired signal minus the filter's prediction.
+class FDAF(Controller):
+
+    # Constructor
+    #   - filter_size: filter length, a multiple of block_size
+    #   - block_size: length of the blocks the weights are adapted after, and of the filter partitions. Larger
+    #     blocks cost less per sample, but adapt less often
+    #   - mu, w: step size and initial weights ("zeros", "random" or an array)
+    #   - normalized: normalize the step size of every frequency bin by the input power in it (mu from 0 to 1),
+    #     otherwise mu is the step size of a (summed) block LMS update
+    #   - forgetting: forgetting factor of the smoothed input power, eps: regularization term of the normalization
+    def __init__(self, name, filter_size=1024, block_size=64, mu=0.5, normalized=True, forgetting=0.9, eps=1e-6,
+                 w="zeros"):
+        super().__init__(name)
+        if filter_size % block_size != 0:
+            raise ValueError(f"filter_size {filter_size} must be a multiple of block_size {block_size}")
+        self.filter_size = filter_size
+        self.block_size = block_size
+        self.num_partitions = filter_size // block_size
+        self.mu = mu
+        self.normalized = normalized
+        self.forgetting = forgetting
+        self.eps = eps
+
+        if isinstance(w, str) and w == "zeros":
+            w = np.zeros(filter_size)
+        elif isinstance(w, str) and w == "random":
+            w = np.random.normal(0, 0.5, filter_size)
+        self.filter = PartitionedConvolver(np.array(w, dtype=float), block_size)
+
+        # Input samples of the previous and current block, and spectra of the input frames of every partition
+        # (newest first)
+        P = block_size
+        self.frame = np.zeros(2 * P)
+        self.frame_spectra = np.zeros((self.num_partitions, P + 1), dtype=complex)
+        self.errors = np.zeros(P)
+        self.position = 0
+
+        # Smoothed input power of every frequency bin, and the number of updates it was smoothed over
+        self.power = np.zeros(P + 1)
+        self.num_updates = 0
+
+        # Input samples and predictions waiting for their desired samples
+        self.pending_inputs = []
+        self.pending_predictions = []
+
+    # Current filter weights
+    @property
+    def w(self):
+        return self.filter.impulse_response
+
+    # Given wav_signal, create output signal to cancel input
+    def input(self, wav_signal):
+        return self.process_block([wav_signal])[0]
+
+    # Update filter weights based on reference signal and previous input
+    def feed_forward(self, reference_signal):
+        self.feed_forward_block([reference_signal])
+
+    # Samples are buffered into blocks in every feed forward mode
+    def supports_vectorized(self, feed):
+        return True
+
+    # Blocks are split where the filter's blocks end, and every piece is fed forward before the next one is
+    # filtered, so the weights change at the same samples as in the per-sample path
+    def process_block(self, x_block, ref_block=None, feedback=False):
+        x_block = np.asarray(x_block, dtype=float)
+        output_block = np.zeros(len(x_block))
+        start = 0
+        while start < len(x_block):
+            end = min(start + self.block_size - self.filter.position, len(x_block))
+            prediction = self.filter.process(x_block[start:end])
+            self.pending_inputs.append(x_block[start:end])
+            self.pending_predictions.append(prediction)
+            output_block[start:end] = -1 * prediction
+
+            if feedback:
+                self.feed_forward_block(x_block[start:end] + output_block[start:end])
+            elif ref_block is not None:
+                self.feed_forward_block(ref_block[start:end])
+            start = end
+        return output_block
+
+    # Feed forward a block of desired samples, for the samples of the last process_block() calls
+    def feed_forward_block(self, error_block):
+        if not self.pending_inputs:
+            return
+        desired = np.asarray(error_block, dtype=float)
+        inputs = np.concatenate(self.pending_inputs)
+        errors = desired - np.concatenate(self.pending_predictions)[:len(desired)]
+        self.pending_inputs = []
+        self.pending_predictions = []
+
+        P = self.block_size
+        start = 0
+        while start < len(desired):
+            length = min(P - self.position, len(desired) - start)
+            self.frame[P + self.position:P + self.position + length] = inputs[start:start + length]
+            self.errors[self.position:self.position + length] = errors[start:start + length]
+            self.position += length
+            start += length
+
+            if self.position == P:
+                self.adapt()
+
+    # The block is complete, update the weights with its errors
+    def adapt(self):
+        P = self.block_size
+        self.frame_spectra = np.roll(self.frame_spectra, 1, axis=0)
+        self.frame_spectra[0] = np.fft.rfft(self.frame)
+        self.frame[:P] = self.frame[P:]
+        self.position = 0
+
+        # Correlate the errors with the input frames of every partition (the errors fill the second half of the
+        # frame, so the first P lags of the circular correlation are the linear ones)
+        gradient = np.conj(self.frame_spectra) * np.fft.rfft(np.concatenate((np.zeros(P), self.errors)))
+        if self.normalized:
+            self.num_updates += 1
+            power = np.sum(np.abs(self.frame_spectra) ** 2, axis=0)
+            self.power = self.forgetting * self.power + (1 - self.forgetting) * power
+            gradient /= self.power / (1 - self.forgetting ** self.num_updates) + self.eps
+
+        # Gradient constraint - keep the first P taps of every partition
+        update = np.fft.irfft(gradient, n=2 * P, axis=1)[:, :P]
+        self.filter.set_impulse_response(self.w + self.mu * update.ravel())
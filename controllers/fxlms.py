@@ -0,0 +1,106 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from controllers.controller import Controller, FEED_NONE
+from controllers.tap_delay_line import TapDelayLine
+from plant import PartitionedConvolver
+
+# Filtered-x LMS Controller -
+#   - LMS controller for simulations with a secondary path (see plant.py), the path from the controller's speaker to
+#     the error microphone
+#
+# The controller output only reaches the error microphone through the secondary path, so the plain LMS update
+# (input window times error) points the weights in the wrong direction. FxLMS instead updates the weights with the
+# input filtered through an estimate of the secondary path, which is what the error actually depends on. The
+# estimate may be thousands of taps long, so the input is filtered with a partitioned FFT convolution.
+#
+# Whatever is fed forward is taken as the error microphone signal, so the controller is meant to be run in a
+# Referenceless simulation.
+class FxLMS(Controller):
+
+    # Constructor
+    #   - secondary_path_estimate: impulse response of the estimated secondary path
+    #   - filter_size, mu, w: filter length, step size and initial weights ("zeros", "random" or an array)
+    #   - normalized: divide the step size by the power of the filtered input window (+ eps), as NLMS does
+    #   - partition_size: partition length of the secondary path convolution
+    def __init__(self, name, secondary_path_estimate, filter_size=256, mu=0.01, normalized=True, eps=1e-6, w="zeros",
+                 partition_size=256):
+        super().__init__(name)
+        self.filter_size = filter_size
+        self.mu = mu
+        self.normalized = normalized
+        self.eps = eps
+
+        if isinstance(w, str) and w == "zeros":
+            self.w = np.zeros(filter_size)
+        elif isinstance(w, str) and w == "random":
+            self.w = np.random.normal(0, 0.5, filter_size)
+        else:
+            self.w = np.array(w, dtype=float)
+
+        # Input filtered through the secondary path estimate
+        self.secondary_path_estimate = np.asarray(secondary_path_estimate, dtype=float)
+        self.secondary_path_filter = PartitionedConvolver(self.secondary_path_estimate, partition_size)
+
+        # History windows of the input and of the filtered input
+        self.history_window = TapDelayLine(self.filter_size)
+        self.filtered_window = TapDelayLine(self.filter_size)
+
+        # Filtered input windows of the last input samples, waiting for their errors
+        self.pending_windows = None
+
+    # Given wav_signal, create output signal to cancel input
+    def input(self, wav_signal):
+        self.history_window.push(wav_signal)
+        self.filtered_window.push(self.secondary_path_filter.process_sample(wav_signal))
+        self.pending_windows = self.filtered_window.view()[None, :]
+
+        return -1 * np.dot(self.w, self.history_window.view())
+
+    # Update filter weights based on the error microphone signal and the filtered input
+    def feed_forward(self, reference_signal):
+        self.feed_forward_block([reference_signal])
+
+    # Without feed forward the weights never change
+    def supports_vectorized(self, feed):
+        return feed == FEED_NONE
+
+    # Block LMS - the weights are held for the whole block, and the per-sample updates are summed into a single
+    # update once the errors of the block are known (a block of 1 matches the per-sample path). The input of the
+    # whole block is filtered through the secondary path estimate in one convolution
+    def process_block(self, x_block, ref_block=None, feedback=False):
+        x_block = np.asarray(x_block, dtype=float)
+        if len(x_block) == 0:
+            return np.zeros(0)
+
+        # A single sample goes straight through input(), which is cheaper than setting up a block
+        if len(x_block) == 1:
+            output_block = np.array([self.input(x_block[0])])
+        else:
+            # Every row of windows is the history window the controller would have seen at that sample
+            windows = sliding_window_view(self.history_window.frame(x_block), self.filter_size)
+            self.history_window.extend(x_block)
+
+            filtered_block = self.secondary_path_filter.process(x_block)
+            self.pending_windows = sliding_window_view(self.filtered_window.frame(filtered_block), self.filter_size)
+            self.filtered_window.extend(filtered_block)
+
+            output_block = -1 * (windows @ self.w)
+
+        if feedback:
+            self.feed_forward_block(x_block + output_block)
+        elif ref_block is not None:
+            self.feed_forward_block(ref_block)
+        return output_block
+
+    # Feed forward a block of error microphone samples, measured after the last process_block() call
+    def feed_forward_block(self, error_block):
+        if self.pending_windows is None:
+            return
+        error_block = np.asarray(error_block, dtype=float)
+        windows = self.pending_windows[:len(error_block)]
+
+        step = self.mu * error_block
+        if self.normalized:
+            step = step / (self.eps + np.einsum("ij,ij->i", windows, windows))
+        self.w = self.w + step @ windows
+        self.pending_windows = None
@@ -1,19 +1,32 @@
 import numpy as np
 import padasip as pa
-from controllers.controller import Controller
+from numpy.lib.stride_tricks import sliding_window_view
+from controllers.controller import Controller, FEED_NONE
+from controllers.tap_delay_line import TapDelayLine
+from controllers.engine import LMSFilter, feed_mode, block_lms_run
 
 class LMS(Controller):
 
     # Constructor
-    def __init__(self, name):
+    #   - engine: "padasip" to use padasip's filter, or "native" to use the filter from controllers/engine.py,
+    #     which processes blocks sample-by-sample in a single (Numba compiled if available) loop
+    #   - exact: with the native engine, always match padasip's numerics bit-for-bit
+    #   - filter_size, mu, w: filter length, step size and initial weights ("random", "zeros" or an array) of the LMS filter
+    def __init__(self, name, engine="padasip", exact=False, filter_size=5, mu=0.1, w="random"):
         super().__init__(name)
+        self.engine = engine
         
-        # Using Padasip, create an LMS filter
-        self.filter_size = 5
-        self.lms_filter = pa.filters.AdaptiveFilter(model="LMS", n=self.filter_size, mu=0.1, w="random")
+        # Create an LMS filter (using Padasip by default)
+        self.filter_size = filter_size
+        if engine == "native":
+            self.lms_filter = LMSFilter(n=self.filter_size, mu=mu, w=w, exact=exact)
+        elif engine == "padasip":
+            self.lms_filter = pa.filters.AdaptiveFilter(model="LMS", n=self.filter_size, mu=mu, w=w)
+        else:
+            raise ValueError(f"Unknown engine {engine}")
         
         # Keep a history window of previous input signals as a state variable 
-        self.history_window = np.zeros(self.filter_size)
+        self.history_window = TapDelayLine(self.filter_size)
 
         # Keep the previous input as a state variable
         self.previous_input = None
@@ -21,12 +34,45 @@ class LMS(Controller):
     # Given wav_signal, create output signal to cancel input
     def input(self, wav_signal):
         self.previous_input = wav_signal
-        self.history_window = np.append(self.history_window, wav_signal)
-        self.history_window = self.history_window[1:]
+        self.history_window.push(wav_signal)
 
-        return -1 * self.lms_filter.predict(self.history_window)
+        return -1 * self.lms_filter.predict(self.history_window.view())
 
     # Update filter weights based on reference signal and previous input
     def feed_forward(self, reference_signal):
         if self.previous_input != None:
-            self.lms_filter.adapt(reference_signal, self.previous_input)
\ No newline at end of file
+            self.lms_filter.adapt(reference_signal, self.previous_input)
+
+    # The native engine runs the per-sample updates itself, and without feed forward the weights never change
+    def supports_vectorized(self, feed):
+        return self.engine == "native" or feed == FEED_NONE
+
+    # Block LMS (padasip engine) - the outputs of the block come from one matrix product, and the per-sample
+    # updates are run over the block in a scalar loop (see engine.block_lms_run()), so any block size gives the
+    # per-sample results
+    def process_block(self, x_block, ref_block=None, feedback=False):
+        x_block = np.asarray(x_block, dtype=float)
+        if len(x_block) == 0:
+            return np.zeros(0)
+
+        # The native engine runs the per-sample updates over the whole block in one loop
+        if self.engine == "native":
+            self.previous_input = x_block[-1]
+            return self.lms_filter.run(x_block, ref_block, feed_mode(ref_block, feedback), self.history_window)
+
+        # A single sample goes straight through input() / feed_forward(), which is cheaper than setting up a block
+        if len(x_block) == 1:
+            return super().process_block(x_block, ref_block, feedback)
+
+        # Every row of windows is the history window the controller would have seen at that sample
+        windows = sliding_window_view(self.history_window.frame(x_block), self.filter_size)
+        self.history_window.extend(x_block)
+        self.previous_input = x_block[-1]
+
+        feed = feed_mode(ref_block, feedback)
+        if feed == FEED_NONE:
+            return -1 * (windows @ self.lms_filter.w)
+
+        step = self.lms_filter.mu * x_block
+        output_block, self.lms_filter.w = block_lms_run(self.lms_filter.w, windows, x_block, ref_block, feed, step)
+        return output_block
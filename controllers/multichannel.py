@@ -0,0 +1,76 @@
+import copy
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from controllers.controller import Controller
+
+# Multichannel Controller -
+#   - Cancels every channel of a multichannel simulation (e.g. the two ears of a headset, or a microphone array)
+#     with an independent controller per channel
+#
+# Blocks of multichannel simulations are (samples, channels) arrays, and column c of every block is handed to the
+# controller of channel c. Each channel's controller processes its whole column at once with its own
+# process_block(), so vectorized controllers stay vectorized. With threads, the channels are processed in parallel
+# by a pool of threads, which pays off for controllers that release the GIL (NumPy block operations, and the
+# compiled kernels of the native engine).
+#
+# Simulations wrap single-channel controllers in a MultichannelController automatically when their recordings have
+# more than one channel (see simulation_core.py). Controllers that handle (samples, channels) blocks themselves can
+# set multichannel = True to be handed the blocks unchanged.
+class MultichannelController(Controller):
+
+    multichannel = True
+
+    # Constructor
+    #   - controllers: one controller per channel
+    #   - threads: number of threads processing the channels in parallel, or None to process them one after the other
+    def __init__(self, controllers, name=None, threads=None):
+        super().__init__(name if name is not None else controllers[0].name)
+        self.controllers = list(controllers)
+        self.channels = len(self.controllers)
+        self.threads = threads
+        self.executor = None
+
+    # Independent copies of controller (with the same initial state) for every channel
+    @classmethod
+    def replicate(cls, controller, channels, threads=None):
+        return cls([copy.deepcopy(controller) for _ in range(channels)], controller.name, threads)
+
+    # The thread pool is not sent along when the controller is copied or sent to another process
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["executor"] = None
+        return state
+
+    # Given a sample of every channel, create the output samples to cancel them
+    def input(self, wav_signal):
+        return np.array([controller.input(sample) for controller, sample in zip(self.controllers, wav_signal)])
+
+    def feed_forward(self, reference_signal):
+        for controller, sample in zip(self.controllers, reference_signal):
+            controller.feed_forward(sample)
+
+    def supports_vectorized(self, feed):
+        return all(controller.supports_vectorized(feed) for controller in self.controllers)
+
+    # Run function(channel) for every channel, in parallel if there are threads
+    def map_channels(self, function):
+        if self.threads is None or self.channels == 1:
+            return [function(channel) for channel in range(self.channels)]
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="channel")
+        return list(self.executor.map(function, range(self.channels)))
+
+    def process_block(self, x_block, ref_block=None, feedback=False):
+        x_block = np.asarray(x_block, dtype=float).reshape(len(x_block), -1)
+        ref_block = None if ref_block is None else np.asarray(ref_block, dtype=float).reshape(len(ref_block), -1)
+
+        def process_channel(channel):
+            ref = None if ref_block is None else np.ascontiguousarray(ref_block[:, channel % ref_block.shape[1]])
+            x = np.ascontiguousarray(x_block[:, channel % x_block.shape[1]])
+            return self.controllers[channel].process_block(x, ref, feedback)
+
+        return np.column_stack(self.map_channels(process_channel))
+
+    def feed_forward_block(self, error_block):
+        error_block = np.asarray(error_block, dtype=float).reshape(len(error_block), -1)
+        self.map_channels(lambda channel: self.controllers[channel].feed_forward_block(np.ascontiguousarray(error_block[:, channel])))
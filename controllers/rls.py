@@ -1,19 +1,33 @@
 import numpy as np
 import padasip as pa
-from controllers.controller import Controller
+from numpy.lib.stride_tricks import sliding_window_view
+from controllers.controller import Controller, FEED_NONE
+from controllers.tap_delay_line import TapDelayLine
+from controllers.engine import RLSFilter, feed_mode
 
 class RLS(Controller):
 
     # Constructor
-    def __init__(self, name):
+    #   - engine: "padasip" to use padasip's filter, or "native" to use the filter from controllers/engine.py,
+    #     which processes blocks sample-by-sample in a single (Numba compiled if available) loop
+    #   - exact: with the native engine, always match padasip's numerics bit-for-bit
+    #   - filter_size, mu, eps, w: filter length, forgetting factor, initialisation value of the inverse
+    #     correlation matrix and initial weights ("random", "zeros" or an array) of the RLS filter
+    def __init__(self, name, engine="padasip", exact=False, filter_size=4, mu=0.9, eps=0.001, w="random"):
         super().__init__(name)
+        self.engine = engine
         
-        # Using Padasip, create an RLS filter
-        self.filter_size = 4
-        self.rls_filter = pa.filters.FilterRLS(mu=0.9, n=self.filter_size)
+        # Create an RLS filter (using Padasip by default)
+        self.filter_size = filter_size
+        if engine == "native":
+            self.rls_filter = RLSFilter(mu=mu, n=self.filter_size, eps=eps, w=w, exact=exact)
+        elif engine == "padasip":
+            self.rls_filter = pa.filters.FilterRLS(mu=mu, n=self.filter_size, eps=eps, w=w)
+        else:
+            raise ValueError(f"Unknown engine {engine}")
         
         # Keep a history window of previous input signals as a state variable 
-        self.history_window = np.zeros(self.filter_size)
+        self.history_window = TapDelayLine(self.filter_size)
 
         # Keep the previous input as a state variable
         self.previous_input = None
@@ -21,12 +35,59 @@ class RLS(Controller):
     # Given wav_signal, create output signal to cancel input
     def input(self, wav_signal):
         self.previous_input = wav_signal
-        self.history_window = np.append(self.history_window, wav_signal)
-        self.history_window = self.history_window[1:]
+        self.history_window.push(wav_signal)
 
-        return -1 * self.rls_filter.predict(self.history_window)
+        return -1 * self.rls_filter.predict(self.history_window.view())
 
     # Update filter weights based on reference signal and previous input
     def feed_forward(self, reference_signal):
         if self.previous_input != None:
-            self.rls_filter.adapt(reference_signal, self.history_window)
\ No newline at end of file
+            self.rls_filter.adapt(reference_signal, self.history_window.view())
+
+    # The native engine runs the per-sample updates itself, and without feed forward the weights never change
+    def supports_vectorized(self, feed):
+        return self.engine == "native" or feed == FEED_NONE
+
+    # Block RLS (padasip engine) - the outputs of the block are produced with the weights held, then the
+    # exponentially weighted least squares solution is updated for the whole block at once.
+    # The end-of-block weights and inverse correlation matrix equal running the per-sample
+    # updates over the block (with the block's a priori outputs)
+    def process_block(self, x_block, ref_block=None, feedback=False):
+        x_block = np.asarray(x_block, dtype=float)
+        if len(x_block) == 0:
+            return np.zeros(0)
+
+        # The native engine runs the per-sample updates over the whole block in one loop
+        if self.engine == "native":
+            self.previous_input = x_block[-1]
+            return self.rls_filter.run(x_block, ref_block, feed_mode(ref_block, feedback), self.history_window)
+
+        # A single sample goes straight through input() / feed_forward(), which is cheaper than setting up a block
+        if len(x_block) == 1:
+            return super().process_block(x_block, ref_block, feedback)
+
+        # Every row of windows is the history window the controller would have seen at that sample
+        windows = sliding_window_view(self.history_window.frame(x_block), self.filter_size)
+        self.history_window.extend(x_block)
+        self.previous_input = x_block[-1]
+
+        w = self.rls_filter.w
+        output_block = -1 * (windows @ w)
+
+        if feedback:
+            desired = x_block + output_block
+        elif ref_block is not None:
+            desired = np.asarray(ref_block, dtype=float)
+        else:
+            return output_block
+
+        # Weight of every sample in the block after forgetting (mu is the forgetting factor)
+        forgetting = self.rls_filter.mu
+        sample_weights = forgetting ** np.arange(len(x_block) - 1, -1, -1)
+        weighted_windows = windows.T * sample_weights
+
+        # R is the inverse of the (exponentially weighted) input correlation matrix
+        correlation = forgetting ** len(x_block) * np.linalg.inv(self.rls_filter.R) + weighted_windows @ windows
+        self.rls_filter.R = np.linalg.inv(correlation)
+        self.rls_filter.w = w + self.rls_filter.R @ (weighted_windows @ (desired + output_block))
+        return output_block
@@ -0,0 +1,152 @@
+import numpy as np
+from controllers.controller import Controller
+from controllers.tap_delay_line import TapDelayLine
+from plant import PartitionedConvolver
+
+# Subband LMS Controller -
+#   - Adaptive filter for long (512 - 4096+ taps) responses that adapts in subbands of a DFT filterbank, where the
+#     filters are short and the updates are made at a decimated rate
+#
+# The input and the error are split into bands with a DFT filterbank (Hann windows of `bands` samples, taken every
+# bands / 2 samples). Every band has its own short complex NLMS filter of filter_size / (bands / 2) taps, adapted
+# on the decimated band signals, so each band's step size is normalized by the power in that band, which converges
+# much faster than fullband LMS on colored input (music, speech, room noise).
+#
+# The band filters are not used to filter the signal (which would delay it by the filterbank). Instead, once per
+# partition the band filters are stacked into one fullband filter of filter_size taps (the frequency response of
+# every band filter fills in the frequency bins of its band), and the input is convolved with it by a
+# PartitionedConvolver (see plant.py), so every sample is still answered right away. The error that is fed back to
+# the bands is the error of that fullband filter (a "delayless" closed-loop subband filter).
+#
+# That costs O(partition_size + filter_size / (bands / 2)) per sample, plus the FFTs of the filterbank and of the
+# weight stacking. Samples are buffered until a band sample is complete, so input() / feed_forward() and
+# process_block() of any block size give the same results.
+#
+# Like the LMS and NLMS controllers, the value fed forward is the desired signal of the filter, and the error is the
+# desired signal minus the filter's prediction.
+class SubbandLMS(Controller):
+
+    # Constructor
+    #   - filter_size: fullband filter length, a multiple of bands / 2
+    #   - bands: length of the filterbank windows (bands / 2 + 1 bands are adapted)
+    #   - mu: step size of the band filters (from 0 to 1)
+    #   - forgetting: forgetting factor of the smoothed power of every band, eps: regularization term
+    #   - partition_size: partition length of the fullband filter's convolution, a multiple of bands / 2, and how
+    #     often (in samples) the band filters are stacked into the fullband filter
+    def __init__(self, name, filter_size=1024, bands=32, mu=0.5, forgetting=0.9, eps=1e-6, partition_size=64):
+        super().__init__(name)
+        self.hop_size = bands // 2
+        if filter_size % self.hop_size != 0 or partition_size % self.hop_size != 0:
+            raise ValueError(f"filter_size {filter_size} and partition_size {partition_size} must be multiples of bands / 2")
+        self.filter_size = filter_size
+        self.bands = bands
+        self.mu = mu
+        self.forgetting = forgetting
+        self.eps = eps
+        self.partition_size = partition_size
+        self.filter = PartitionedConvolver(np.zeros(filter_size), partition_size)
+
+        # Analysis filterbank - windows of the last `bands` input and error samples
+        self.window = np.hanning(bands)
+        self.input_window = TapDelayLine(bands)
+        self.error_window = TapDelayLine(bands)
+        self.position = 0
+
+        # Band filters, and the band samples of the input they filter (newest first)
+        self.band_filter_size = filter_size // self.hop_size
+        self.band_weights = np.zeros((bands // 2 + 1, self.band_filter_size), dtype=complex)
+        self.band_inputs = np.zeros((bands // 2 + 1, self.band_filter_size), dtype=complex)
+
+        # Smoothed power of every band, and the number of updates it was smoothed over
+        self.power = np.zeros(bands // 2 + 1)
+        self.num_updates = 0
+
+        # Weight stacking - the band and the bin of its band filter's frequency response of every fullband bin
+        bins = np.arange(filter_size // 2 + 1)
+        self.stacking_bands = np.minimum(np.round(bins * bands / filter_size).astype(int), bands // 2)
+        self.stacking_bins = bins % self.band_filter_size
+
+        # Input samples and predictions waiting for their desired samples
+        self.pending_inputs = []
+        self.pending_predictions = []
+
+    # Current fullband filter weights
+    @property
+    def w(self):
+        return self.filter.impulse_response
+
+    # Given wav_signal, create output signal to cancel input
+    def input(self, wav_signal):
+        return self.process_block([wav_signal])[0]
+
+    # Update filter weights based on reference signal and previous input
+    def feed_forward(self, reference_signal):
+        self.feed_forward_block([reference_signal])
+
+    # Samples are buffered into band samples in every feed forward mode
+    def supports_vectorized(self, feed):
+        return True
+
+    # Blocks are split where the band samples end, and every piece is fed forward before the next one is filtered,
+    # so the weights change at the same samples as in the per-sample path
+    def process_block(self, x_block, ref_block=None, feedback=False):
+        x_block = np.asarray(x_block, dtype=float)
+        output_block = np.zeros(len(x_block))
+        start = 0
+        while start < len(x_block):
+            end = min(start + self.hop_size - self.filter.position % self.hop_size, len(x_block))
+            prediction = self.filter.process(x_block[start:end])
+            self.pending_inputs.append(x_block[start:end])
+            self.pending_predictions.append(prediction)
+            output_block[start:end] = -1 * prediction
+
+            if feedback:
+                self.feed_forward_block(x_block[start:end] + output_block[start:end])
+            elif ref_block is not None:
+                self.feed_forward_block(ref_block[start:end])
+            start = end
+        return output_block
+
+    # Feed forward a block of desired samples, for the samples of the last process_block() calls
+    def feed_forward_block(self, error_block):
+        if not self.pending_inputs:
+            return
+        desired = np.asarray(error_block, dtype=float)
+        inputs = np.concatenate(self.pending_inputs)
+        errors = desired - np.concatenate(self.pending_predictions)[:len(desired)]
+        self.pending_inputs = []
+        self.pending_predictions = []
+
+        start = 0
+        while start < len(desired):
+            length = min(self.hop_size - self.position % self.hop_size, len(desired) - start)
+            self.input_window.extend(inputs[start:start + length])
+            self.error_window.extend(errors[start:start + length])
+            self.position += length
+            start += length
+
+            if self.position % self.hop_size == 0:
+                self.adapt()
+            if self.position == self.partition_size:
+                self.position = 0
+                self.filter.set_impulse_response(self.stack_weights())
+
+    # Band samples of the newest window of signal (analysis filterbank)
+    def analyze(self, signal_window):
+        return np.conj(np.fft.rfft(self.window * signal_window.view()[::-1]))
+
+    # A band sample is complete, update the band filters with its error
+    def adapt(self):
+        self.band_inputs = np.roll(self.band_inputs, 1, axis=1)
+        self.band_inputs[:, 0] = self.analyze(self.input_window)
+        band_errors = self.analyze(self.error_window)
+
+        self.num_updates += 1
+        self.power = self.forgetting * self.power + (1 - self.forgetting) * np.abs(self.band_inputs[:, 0]) ** 2
+        power = self.band_filter_size * self.power / (1 - self.forgetting ** self.num_updates) + self.eps
+        self.band_weights += (self.mu * band_errors / power)[:, None] * np.conj(self.band_inputs)
+
+    # Fullband filter whose frequency response is made of the frequency responses of the band filters
+    def stack_weights(self):
+        responses = np.fft.fft(self.band_weights, axis=1)
+        return np.fft.irfft(responses[self.stacking_bands, self.stacking_bins], n=self.filter_size)
@@ -0,0 +1,52 @@
+import numpy as np
+
+# Tap Delay Line -
+#   - Preallocated circular buffer holding the last `size` input samples of a controller
+#
+# Every sample is written twice, once in each half of a buffer of length 2 * size, so the
+# window ordered from oldest to newest sample is always one contiguous slice of the buffer.
+# view() can therefore hand the filter the window without any copying, and push() costs the
+# same no matter how many taps the filter has (unlike np.append, which copies every tap).
+class TapDelayLine:
+
+    # Constructor
+    def __init__(self, size):
+        self.size = size
+        self.buffer = np.zeros(2 * size)
+
+        # Index of the oldest sample of the window
+        self.position = 0
+
+    # Add one sample as the newest sample of the window (dropping the oldest one)
+    def push(self, sample):
+        self.buffer[self.position] = sample
+        self.buffer[self.position + self.size] = sample
+        self.position = (self.position + 1) % self.size
+
+    # Add a block of samples, in order, as the newest samples of the window
+    def extend(self, block):
+        block = np.asarray(block)
+        if len(block) >= self.size:
+            self.buffer[:self.size] = block[-self.size:]
+            self.buffer[self.size:] = block[-self.size:]
+            self.position = 0
+        elif len(block) > 0:
+            indices = (self.position + np.arange(len(block))) % self.size
+            self.buffer[indices] = block
+            self.buffer[indices + self.size] = block
+            self.position = (self.position + len(block)) % self.size
+
+    # Ordered window (oldest sample first) as a view into the buffer
+    # Note the view is only valid until the next push/extend, copy it if it needs to be kept
+    def view(self):
+        return self.buffer[self.position:self.position + self.size]
+
+    # Window followed by a block of new samples, without its oldest sample, so that every
+    # length `size` slice of the result is the window the filter sees at one sample of the block
+    def frame(self, block):
+        return np.concatenate((self.view()[1:], block))
+
+    # Reset every tap back to zero
+    def clear(self):
+        self.buffer[:] = 0
+        self.position = 0
@@ -0,0 +1,369 @@
+import argparse
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import sqlite3
+import sys
+import time
+import types
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import scipy.io.wavfile as wav
+import scipy.signal
+from comparison import SIMULATIONS, Scenario, file_name
+from output_sink import ArraySink
+from sweep import find_peaks
+
+# Batch Evaluation -
+#   - Runs every controller of a set of manifests against every scenario, and keeps the metrics of every run in a
+#     SQLite database, so runs that were already done are never run again
+#
+# Run from the repo root with:
+#
+#   python -m evaluate manifest.json [more manifests...] --db results.sqlite
+#
+# Manifests are JSON files with a list of "scenarios" (the arguments of comparison.Scenario) and/or a list of
+# "controllers" (a name, the controller class as "module:ClassName" and its constructor parameters), and every
+# controller is run against every scenario of all the manifests together. Relative file paths are relative to the
+# manifest. For example:
+#
+#   {"scenarios": [{"name": "coffeeshop", "simulation": "referenceless", "noise_file_path": "sounds/coffeeshop.wav",
+#                   "num_timesteps": 100000}],
+#    "controllers": [{"name": "NLMS", "class": "controllers.nlms:NLMS", "params": {"filter_size": 10, "mu": 0.05}},
+#                    {"name": "FDAF", "class": "controllers.fdaf:FDAF", "params": {"filter_size": 1024}}],
+#    "seed": 0}
+#
+# Every run is keyed by a hash of everything its result depends on: the scenario, the contents of its wav files, the
+# controller class and parameters, the random seed, and the source code of the controller and the simulation (the
+# repo modules they use, found through their imports). Runs whose key is already in the database are skipped, so
+# after changing one controller only that controller's runs are done again. Pass --force to redo them anyway.
+#
+# The database has a runs table (MSE, overall attenuation, liveness, convergence time and throughput of every run,
+# the convergence time is NULL if the noise was never attenuated) and a band_attenuation table (attenuation in every
+# frequency band of every run, see BANDS), joined on key.
+
+# Bump when the metrics are computed differently, so every run is done again
+METRICS_VERSION = 2
+
+# Edges of the frequency bands attenuation is measured in, in Hz (the last band goes up to fs / 2)
+BANDS = [0, 125, 250, 500, 1000, 2000, 4000, 8000]
+
+# Convergence is measured on the attenuation in windows of this many seconds, smoothed over CONVERGENCE_SMOOTHING seconds
+CONVERGENCE_WINDOW = 0.05
+CONVERGENCE_SMOOTHING = 0.25
+
+REPO_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    key TEXT PRIMARY KEY,
+    scenario TEXT,
+    simulation TEXT,
+    controller TEXT,
+    controller_class TEXT,
+    params TEXT,
+    seed INTEGER,
+    inputs_hash TEXT,
+    code_version TEXT,
+    fs INTEGER,
+    num_samples INTEGER,
+    mse REAL,
+    attenuation_db REAL,
+    liveness INTEGER,
+    convergence_time REAL,
+    seconds REAL,
+    samples_per_second REAL,
+    created REAL
+);
+CREATE TABLE IF NOT EXISTS band_attenuation (
+    key TEXT,
+    low REAL,
+    high REAL,
+    attenuation_db REAL,
+    PRIMARY KEY (key, low)
+);
+CREATE INDEX IF NOT EXISTS runs_scenario ON runs (scenario);
+CREATE INDEX IF NOT EXISTS runs_controller ON runs (controller);
+"""
+
+
+# Load a class from "module:ClassName"
+def load_class(spec):
+    module_name, class_name = spec.split(":")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+# Read manifests into (scenarios, controllers, seed), with the file paths of scenarios made absolute
+def read_manifests(file_paths):
+    scenarios, controllers, seed = [], [], 0
+    for file_path in file_paths:
+        with open(file_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        directory = os.path.dirname(os.path.abspath(file_path))
+        for spec in manifest.get("scenarios", []):
+            spec = dict(spec)
+            for name in ("noise_file_path", "reference_file_path"):
+                if spec.get(name) is not None:
+                    spec[name] = os.path.join(directory, spec[name])
+            # Runs are told apart by the names of their scenarios
+            if any(scenario.name == spec.get("name") for scenario in scenarios):
+                raise ValueError(f"Scenario {spec.get('name')} of {file_path} is defined more than once")
+            scenarios.append(Scenario(**spec))
+        for spec in manifest.get("controllers", []):
+            if "name" not in spec or "class" not in spec:
+                raise ValueError(f"Controllers need a name and a class in {file_path}: {spec}")
+            if any(controller["name"] == spec["name"] for controller in controllers):
+                raise ValueError(f"Controller {spec['name']} of {file_path} is defined more than once")
+            controllers.append({"name": spec["name"], "class": spec["class"], "params": spec.get("params", {})})
+        seed = manifest.get("seed", seed)
+    return scenarios, controllers, seed
+
+
+_file_hashes = {}
+
+
+# SHA-256 of a file's contents, computed once per version of the file
+def file_hash(file_path):
+    status = os.stat(file_path)
+    key = (os.path.abspath(file_path), status.st_mtime_ns, status.st_size)
+    if key not in _file_hashes:
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as input_file:
+            for chunk in iter(lambda: input_file.read(1 << 20), b""):
+                digest.update(chunk)
+        _file_hashes[key] = digest.hexdigest()
+    return _file_hashes[key]
+
+
+# Source files of the repo modules that module uses, found recursively through the modules, classes and functions
+# it imports
+def source_files(module, found=None):
+    found = set() if found is None else found
+    file_path = getattr(module, "__file__", None)
+    if file_path is None or not os.path.abspath(file_path).startswith(REPO_DIRECTORY + os.sep) or file_path in found:
+        return found
+    found.add(file_path)
+    for value in vars(module).values():
+        if isinstance(value, types.ModuleType):
+            source_files(value, found)
+        elif inspect.isclass(value) or inspect.isfunction(value):
+            used = sys.modules.get(getattr(value, "__module__", None))
+            if used is not None:
+                source_files(used, found)
+    return found
+
+
+# Hash of the source code a run of the controller class in the simulation class depends on
+def code_version(controller_class, simulation_class):
+    files = source_files(sys.modules[controller_class.__module__]) | source_files(sys.modules[simulation_class.__module__])
+    digest = hashlib.sha256(f"metrics {METRICS_VERSION}".encode())
+    for file_path in sorted(files):
+        digest.update(os.path.relpath(file_path, REPO_DIRECTORY).encode())
+        digest.update(file_hash(file_path).encode())
+    return digest.hexdigest()
+
+
+# Hash of the scenario's settings and the contents of its wav files
+def inputs_hash(scenario):
+    settings = {"simulation": scenario.simulation, "num_timesteps": scenario.num_timesteps,
+                "block_size": scenario.block_size,
+                "noise": file_hash(scenario.noise_file_path),
+                "reference": file_hash(scenario.reference_file_path) if scenario.reference_file_path else None}
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()
+
+
+# Every (scenario, controller) run, with its key
+def plan(scenarios, controllers, seed):
+    jobs = []
+    for scenario in scenarios:
+        simulation_class = SIMULATIONS[scenario.simulation]
+        scenario_hash = inputs_hash(scenario)
+        for controller in controllers:
+            version = code_version(load_class(controller["class"]), simulation_class)
+            identity = {"scenario": scenario.name, "inputs": scenario_hash, "controller": controller["name"],
+                        "class": controller["class"], "params": controller["params"], "seed": seed, "code": version}
+            key = hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+            jobs.append({"key": key, "scenario": scenario, "controller": controller, "seed": seed,
+                         "inputs_hash": scenario_hash, "code_version": version})
+    return jobs
+
+
+# Attenuation of the noise at the error microphone in every band, as (low, high, dB) rows
+def band_attenuation(error, noise, fs, bands=BANDS):
+    nperseg = min(4096, len(error))
+    frequencies, noise_power = scipy.signal.welch(noise, fs, nperseg=nperseg, axis=0)
+    _, error_power = scipy.signal.welch(error, fs, nperseg=nperseg, axis=0)
+    noise_power = noise_power.reshape(len(frequencies), -1).sum(axis=1)
+    error_power = error_power.reshape(len(frequencies), -1).sum(axis=1)
+
+    rows = []
+    edges = [edge for edge in bands if edge < fs / 2] + [fs / 2]
+    for low, high in zip(edges[:-1], edges[1:]):
+        in_band = (frequencies >= low) & (frequencies < high)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            attenuation = 10 * np.log10(np.sum(noise_power[in_band]) / np.sum(error_power[in_band]))
+        rows.append((float(low), float(high), float(attenuation)))
+    return rows
+
+
+# Time (in seconds) it took the attenuation to converge, or None if it never reached min_improvement_db. The
+# attenuation of every window is smoothed over the last smoothing seconds, and it has converged once it stays above
+# fraction of the way from no attenuation (0 dB, the noise before the controller cancels any of it) to its final
+# value (the median over the last tenth of the run)
+def convergence_time(error, noise, fs, window=CONVERGENCE_WINDOW, smoothing=CONVERGENCE_SMOOTHING, fraction=0.9,
+                     min_improvement_db=3.0):
+    window_size = max(1, int(window * fs))
+    num_windows = len(error) // window_size
+    if num_windows < 2:
+        return None
+    error_power = window_power(error, window_size, num_windows)
+    noise_power = window_power(noise, window_size, num_windows)
+
+    # Power summed over the trailing smoothing windows, which also evens out how loud the noise is from window to window
+    kernel = np.ones(max(1, int(round(smoothing / window))))
+    error_power = np.convolve(error_power, kernel)[:num_windows]
+    noise_power = np.convolve(noise_power, kernel)[:num_windows]
+    tiny = np.finfo(float).tiny
+    attenuation = 10 * np.log10((noise_power + tiny) / (error_power + tiny))
+
+    final = np.median(attenuation[-max(1, num_windows // 10):])
+    if final < min_improvement_db:
+        return None
+    below = np.nonzero(attenuation < fraction * final)[0]
+    return 0.0 if len(below) == 0 else float((below[-1] + 1) * window_size / fs)
+
+
+# Power of every window of window_size samples (over every channel)
+def window_power(signal, window_size, num_windows):
+    signal = np.asarray(signal, dtype=float)[:num_windows * window_size]
+    return np.square(signal).reshape(num_windows, -1).mean(axis=1)
+
+
+# Run one job in a worker process, returning its runs row and band_attenuation rows
+def run_job(job, peaks, output_dir=None):
+    scenario, spec = job["scenario"], job["controller"]
+    np.random.seed(job["seed"])
+    controller = load_class(spec["class"])(spec["name"], **spec["params"])
+    simulation = scenario.build(controller, peaks)
+
+    sink = ArraySink()
+    start_time = time.perf_counter()
+    error_mic = simulation.simulate(sink=sink, plot=False)
+    seconds = time.perf_counter() - start_time
+
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        wav.write(os.path.join(output_dir, f"{job['key'][:16]}_{file_name(spec['name'])}.wav"), simulation.fs,
+                  np.asarray(error_mic, dtype=np.float32))
+
+    # The noise and error relative to the target (the reference signal, or silence without one)
+    inp, reference = next(simulation.source.frames(simulation.n))
+    target = 0 if reference is None else reference
+    noise = inp - target
+    error = error_mic - target
+
+    row = {
+        "key": job["key"],
+        "scenario": scenario.name,
+        "simulation": scenario.simulation,
+        "controller": spec["name"],
+        "controller_class": spec["class"],
+        "params": json.dumps(spec["params"], sort_keys=True),
+        "seed": job["seed"],
+        "inputs_hash": job["inputs_hash"],
+        "code_version": job["code_version"],
+        "fs": simulation.fs,
+        "num_samples": simulation.n,
+        "mse": float(simulation.mse),
+        "attenuation_db": float(simulation.attenuation_db),
+        "liveness": int(simulation.liveness_is_satisfied),
+        "convergence_time": convergence_time(error, noise, simulation.fs),
+        "seconds": seconds,
+        "samples_per_second": simulation.n / seconds if seconds > 0 else float("inf"),
+        "created": time.time(),
+    }
+    return row, band_attenuation(error, noise, simulation.fs)
+
+
+class ResultsDatabase:
+
+    # Constructor
+    def __init__(self, file_path):
+        self.connection = sqlite3.connect(file_path)
+        self.connection.executescript(SCHEMA)
+
+    def has(self, key):
+        return self.connection.execute("SELECT 1 FROM runs WHERE key = ?", (key,)).fetchone() is not None
+
+    # Store a run, replacing an earlier one with the same key
+    def store(self, row, bands):
+        with self.connection:
+            self.connection.execute(f"INSERT OR REPLACE INTO runs ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                                    list(row.values()))
+            self.connection.execute("DELETE FROM band_attenuation WHERE key = ?", (row["key"],))
+            self.connection.executemany("INSERT INTO band_attenuation VALUES (?, ?, ?, ?)",
+                                        [(row["key"], low, high, attenuation) for low, high, attenuation in bands])
+
+    # Rows of the runs with the given keys, in that order
+    def runs(self, keys):
+        self.connection.row_factory = sqlite3.Row
+        rows = {}
+        for row in self.connection.execute(f"SELECT * FROM runs WHERE key IN ({', '.join('?' * len(keys))})", keys):
+            rows[row["key"]] = dict(row)
+        self.connection.row_factory = None
+        return [rows[key] for key in keys if key in rows]
+
+    def close(self):
+        self.connection.close()
+
+
+# Run every job that has no results in the database yet (or every job with force), storing the results as they
+# finish. Returns the rows of every job, and the number of jobs that were run
+def evaluate(jobs, database, processes=None, force=False, output_dir=None):
+    pending = [job for job in jobs if force or not database.has(job["key"])]
+    if pending:
+        peaks = find_peaks(job["scenario"] for job in pending)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = {executor.submit(run_job, job, peaks, output_dir): job for job in pending}
+            for future in as_completed(futures):
+                row, bands = future.result()
+                database.store(row, bands)
+                print(f"Finished {row['scenario']} / {row['controller']}: mse {row['mse']:.6g}, "
+                      f"{row['samples_per_second']:.0f} samples/s")
+    return database.runs([job["key"] for job in jobs]), len(pending)
+
+
+def print_runs(rows):
+    print(f"{'scenario':<20} {'controller':<20} {'mse':>12} {'atten (dB)':>10} {'liveness':>9} {'converged (s)':>13} {'samples/s':>12}")
+    for row in rows:
+        converged = "never" if row["convergence_time"] is None else f"{row['convergence_time']:.3f}"
+        print(f"{row['scenario']:<20} {row['controller']:<20} {row['mse']:>12.6g} {row['attenuation_db']:>10.2f} "
+              f"{str(bool(row['liveness'])):>9} {converged:>13} {row['samples_per_second']:>12.0f}")
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Run every controller of the manifests against every scenario, "
+                                                 "skipping runs that already have results")
+    parser.add_argument("manifests", nargs="+", help="JSON manifests of scenarios and controllers")
+    parser.add_argument("--db", default="results.sqlite", help="SQLite database the results are kept in")
+    parser.add_argument("--processes", type=int, help="number of worker processes, defaults to the number of CPUs")
+    parser.add_argument("--force", action="store_true", help="run every job again, even if it has results")
+    parser.add_argument("--output-dir", help="also write the error microphone signal of every run here")
+    args = parser.parse_args(args)
+
+    scenarios, controllers, seed = read_manifests(args.manifests)
+    jobs = plan(scenarios, controllers, seed)
+    database = ResultsDatabase(args.db)
+    try:
+        rows, num_run = evaluate(jobs, database, args.processes, args.force, args.output_dir)
+    finally:
+        database.close()
+    print(f"\n{num_run} of {len(jobs)} runs done, {len(jobs) - num_run} already had results in {args.db}\n")
+    print_runs(rows)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import numpy as np
+from controllers.tap_delay_line import TapDelayLine
+
+# Liveness Monitor -
+#   - Checks the liveness property of a simulation, and keeps running performance metrics of the error microphone
+#
+# Every sample of the error microphone gets a liveness value (the ratio function, see reference_ratio and
+# input_ratio below), and liveness is satisfied once the average of those values over a window of
+# window_size samples drops below threshold (only checked once the window has been filled). The window is
+# either sliding (the last window_size samples, starting from a window of zeros) or fixed (the first window_size
+# samples of the simulation). Along with liveness, the monitor keeps:
+#   - mse: running mean squared error between the error microphone and the target (the reference signal,
+#     or silence when there is no reference)
+#   - attenuation_db: how much the noise (input - target) was reduced at the error microphone (error - target), in dB
+#
+# With multichannel signals ((samples, channels) blocks), the liveness value of a sample is the average over the
+# channels, and mse is the mean over every sample of every channel.
+#
+# update() takes the signals one block at a time, and costs the same per sample no matter the window size
+# (the sliding window sum is kept as a running sum). evaluate() computes the same verdict and metrics from
+# the finished signals in one vectorized pass.
+
+
+# Liveness value of the Referenceful simulation, how far the error microphone is from the reference signal
+def reference_ratio(error, reference, inp):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(reference != 0, np.abs(1 - np.abs(error / reference)) / 100, 1)
+
+
+# Liveness value of the Referenceless and Filtered simulations, how much of the input is left at the error microphone
+def input_ratio(error, reference, inp):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(inp != 0, np.abs(error / inp), 0)
+
+
+class LivenessMonitor:
+
+    # Recompute the running window sum from scratch every this many windows, so rounding errors can't build up
+    RESYNC_WINDOWS = 100
+
+    # Constructor
+    #   - ratio: function (error, reference, inp) -> liveness value of every sample
+    #   - sliding: check the last window_size samples (True) or only the first window_size samples (False)
+    def __init__(self, window_size, threshold, ratio, sliding=True):
+        self.window_size = window_size
+        self.threshold = threshold
+        self.ratio = ratio
+        self.sliding = sliding
+        self.reset()
+
+    def reset(self):
+        self.window = TapDelayLine(self.window_size)
+        self.window_sum = 0.0
+        self.samples_since_resync = 0
+        self.n = 0
+        self.num_values = 0
+        self.liveness_is_satisfied = False
+        self.squared_error = 0.0
+        self.squared_noise = 0.0
+
+    # Running mean squared error between the error microphone and the target
+    @property
+    def mse(self):
+        return self.squared_error / self.num_values if self.num_values > 0 else 0.0
+
+    # Reduction of the noise at the error microphone, in dB
+    @property
+    def attenuation_db(self):
+        with np.errstate(divide="ignore"):
+            return 10 * np.log10(self.squared_noise / self.squared_error) if self.squared_error > 0 else float("inf")
+
+    # Liveness value of every sample, averaged over the channels of multichannel signals
+    def channel_average(self, values):
+        values = np.asarray(values, dtype=float)
+        return values.mean(axis=1) if values.ndim > 1 else values
+
+    # Monitor a block of the simulation
+    #   - error: block of error microphone samples
+    #   - reference: block of reference samples, or None if the simulation has no reference (target is silence)
+    #   - inp: block of input samples
+    def update(self, error, reference, inp):
+        error = np.asarray(error, dtype=float)
+        inp = np.asarray(inp, dtype=float)
+        values = self.channel_average(self.ratio(error, reference, inp))
+        start = self.n
+        self.n += len(error)
+        self.num_values += error.size
+
+        target = 0 if reference is None else reference
+        self.squared_error += np.sum(np.square(error - target))
+        self.squared_noise += np.sum(np.square(inp - target))
+
+        if self.liveness_is_satisfied or len(values) == 0:
+            return self.liveness_is_satisfied
+
+        # Window average at every sample of the block
+        if self.sliding:
+            window = self.window.view()
+            if len(values) <= self.window_size:
+                dropped = window[:len(values)]
+            else:
+                dropped = np.concatenate((window, values[:len(values) - self.window_size]))
+            averages = (self.window_sum + np.cumsum(values) - np.cumsum(dropped)) / self.window_size
+            self.window_sum = self.window_sum + np.sum(values) - np.sum(dropped)
+            self.window.extend(values)
+
+            self.samples_since_resync += len(values)
+            if self.samples_since_resync >= self.RESYNC_WINDOWS * self.window_size:
+                self.window_sum = np.sum(self.window.view())
+                self.samples_since_resync = 0
+        else:
+            # Only the first window is kept
+            first = values[:max(0, self.window_size - start)]
+            self.window_sum += np.sum(first)
+            averages = np.full(len(values), self.window_sum / self.window_size)
+
+        # Only check monitor once liveness window is filled
+        checked = np.arange(start, self.n) >= self.window_size
+        self.liveness_is_satisfied = bool(np.any(averages[checked] < self.threshold))
+        return self.liveness_is_satisfied
+
+    # Monitor a whole finished simulation at once (replaces anything monitored before)
+    def evaluate(self, error, reference, inp):
+        self.reset()
+        error = np.asarray(error, dtype=float)
+        inp = np.asarray(inp, dtype=float)
+        values = self.channel_average(self.ratio(error, reference, inp))
+        self.n = len(error)
+        self.num_values = error.size
+
+        target = 0 if reference is None else reference
+        self.squared_error = np.sum(np.square(error - target))
+        self.squared_noise = np.sum(np.square(inp - target))
+
+        if self.n <= self.window_size:
+            return self.liveness_is_satisfied
+        if self.sliding:
+            sums = np.cumsum(np.concatenate((np.zeros(self.window_size + 1), values)))
+            averages = (sums[self.window_size + 1:] - sums[1:self.n + 1]) / self.window_size
+            self.liveness_is_satisfied = bool(np.any(averages[self.window_size:] < self.threshold))
+        else:
+            self.liveness_is_satisfied = bool(np.sum(values[:self.window_size]) / self.window_size < self.threshold)
+        return self.liveness_is_satisfied
@@ -0,0 +1,199 @@
+import struct
+import numpy as np
+import scipy.io.wavfile as wav
+from abc import ABC, abstractmethod
+
+# Output Sinks -
+#   - Receive the error microphone signal from a simulation one block at a time
+#
+# A simulation calls open() before its first block, write() for every block and close() once it is done.
+# close() returns the result of the simulation, and signal() gives back the whole signal (or None) so it
+# can be plotted. The sinks provided are:
+#   - ArraySink: keeps the signal in a preallocated float32/float64 array (returned by close())
+#   - WavSink: writes the signal to a wav file as the simulation runs (close() returns the file path)
+#   - NullSink: throws the signal away, for benchmark runs
+#
+# For checkpoints (see checkpoint.py), get_state() gives the state of the sink as a dict of arrays, and reopen() is
+# called instead of open() when a simulation is resumed, to carry on from that state. Both are given the path of the
+# checkpoint file, so sinks can keep their samples next to it instead of in every checkpoint. Sinks that don't
+# implement them start over from the resumed sample.
+class OutputSink(ABC):
+
+    # Called before the first block, with the number of samples, sample rate and number of channels of the simulation
+    # (blocks of multichannel simulations are (samples, channels) arrays)
+    def open(self, n, fs, channels=1):
+        pass
+
+    @abstractmethod
+    def write(self, block):
+        pass
+
+    # Called after the last block, returns the result of the simulation
+    def close(self):
+        return None
+
+    # Whole signal written to the sink, or None if it was not kept
+    def signal(self):
+        return None
+
+    # State of the sink for the checkpoint written to checkpoint_file, as a dict of NumPy arrays
+    def get_state(self, checkpoint_file=None):
+        return {}
+
+    # Called instead of open() when a simulation is resumed, with the state from get_state()
+    def reopen(self, n, fs, channels, state, checkpoint_file=None):
+        self.open(n, fs, channels)
+
+
+class ArraySink(OutputSink):
+
+    # Constructor
+    def __init__(self, dtype=np.float64):
+        self.dtype = dtype
+        self.data = None
+        self.position = 0
+        self.saved = 0
+
+    def open(self, n, fs, channels=1):
+        self.data = np.zeros(n if channels == 1 else (n, channels), dtype=self.dtype)
+        self.position = 0
+        self.saved = 0
+
+    def write(self, block):
+        self.data[self.position:self.position + len(block)] = block
+        self.position += len(block)
+
+    # Only return the samples that were written (the simulation may have been stopped early)
+    def close(self):
+        return self.signal()
+
+    def signal(self):
+        return self.data[:self.position]
+
+    # Raw file the samples of the checkpoints written to checkpoint_file are kept in
+    @staticmethod
+    def samples_path(checkpoint_file):
+        return f"{checkpoint_file}.samples"
+
+    # Only the samples written since the last checkpoint are appended to the samples file, and the checkpoint
+    # records how many of its samples belong to it, so every checkpoint costs the same however long the run is.
+    # Without a checkpoint file, the samples are part of the state
+    def get_state(self, checkpoint_file=None):
+        if checkpoint_file is None:
+            return {"data": self.signal()}
+
+        # Samples after the ones saved (from an interrupted checkpoint, or a run resumed from an earlier one) are
+        # written over
+        frame_size = self.data[:1].nbytes
+        with open(self.samples_path(checkpoint_file), "r+b" if self.saved > 0 else "wb") as samples_file:
+            samples_file.seek(self.saved * frame_size)
+            samples_file.truncate()
+            self.data[self.saved:self.position].tofile(samples_file)
+        self.saved = self.position
+        return {"num_samples": np.array(self.position)}
+
+    def reopen(self, n, fs, channels, state, checkpoint_file=None):
+        self.open(n, fs, channels)
+        if "data" in state:
+            self.write(state["data"])
+            return
+
+        num_samples = int(state["num_samples"])
+        data = np.fromfile(self.samples_path(checkpoint_file), dtype=self.dtype, count=self.data[:num_samples].size)
+        if data.size != self.data[:num_samples].size:
+            raise ValueError(f"{self.samples_path(checkpoint_file)} has fewer than the {num_samples} samples of the checkpoint")
+        self.write(data.reshape(self.data[:num_samples].shape))
+        self.saved = num_samples
+
+
+class WavSink(OutputSink):
+
+    # Size of the RIFF, fmt, fact and data chunk headers written before the samples
+    HEADER_SIZE = 58
+
+    # Constructor
+    #   - dtype: sample format of the wav file, float32 or float64
+    #   - buffer_size: number of samples kept in memory before they are flushed to the file
+    def __init__(self, file_path, dtype=np.float32, buffer_size=65536):
+        if np.dtype(dtype) not in (np.dtype(np.float32), np.dtype(np.float64)):
+            raise ValueError(f"WavSink only supports float32 and float64 samples, not {np.dtype(dtype)}")
+        self.file_path = file_path
+        self.dtype = np.dtype(dtype)
+        self.buffer_size = buffer_size
+        self.file = None
+
+    def open(self, n, fs, channels=1):
+        self.fs = fs
+        self.channels = channels
+        self.num_frames = 0
+        self.pending = []
+        self.pending_size = 0
+
+        # The header is written once the number of samples is known, leave room for it
+        self.file = open(self.file_path, "wb")
+        self.file.write(b"\x00" * self.HEADER_SIZE)
+
+    def write(self, block):
+        block = np.asarray(block, dtype=self.dtype)
+        self.channels = 1 if block.ndim == 1 else block.shape[1]
+        self.num_frames += len(block)
+        self.pending.append(block)
+        self.pending_size += block.size
+        if self.pending_size >= self.buffer_size:
+            self.flush()
+
+    # Write the buffered samples to the file
+    def flush(self):
+        if self.pending:
+            np.concatenate(self.pending).astype(self.dtype.newbyteorder("<"), copy=False).tofile(self.file)
+            self.file.flush()
+        self.pending = []
+        self.pending_size = 0
+
+    def close(self):
+        if self.file is None:
+            return self.file_path
+        self.flush()
+
+        # Go back and fill in the header, same layout scipy uses for float wav files
+        bytes_per_sample = self.dtype.itemsize
+        data_size = self.num_frames * self.channels * bytes_per_sample
+        header = b"RIFF" + struct.pack("<I", self.HEADER_SIZE - 8 + data_size) + b"WAVE"
+        header += b"fmt " + struct.pack("<IHHIIHHH", 18, 3, self.channels, self.fs,
+                                        self.fs * self.channels * bytes_per_sample,
+                                        self.channels * bytes_per_sample, bytes_per_sample * 8, 0)
+        header += b"fact" + struct.pack("<II", 4, self.num_frames)
+        header += b"data" + struct.pack("<I", data_size)
+        self.file.seek(0)
+        self.file.write(header)
+        self.file.close()
+        self.file = None
+        return self.file_path
+
+    # The samples written so far are flushed to the file, so only their number is needed
+    def get_state(self, checkpoint_file=None):
+        self.flush()
+        return {"num_frames": np.array(self.num_frames), "channels": np.array(self.channels)}
+
+    # Reopen the file without the samples written after the checkpoint
+    def reopen(self, n, fs, channels, state, checkpoint_file=None):
+        self.fs = fs
+        self.channels = int(state["channels"])
+        self.num_frames = int(state["num_frames"])
+        self.pending = []
+        self.pending_size = 0
+
+        self.file = open(self.file_path, "r+b")
+        self.file.truncate(self.HEADER_SIZE + self.num_frames * self.channels * self.dtype.itemsize)
+        self.file.seek(0, 2)
+
+    # Read the written signal back from the wav file (memory-mapped)
+    def signal(self):
+        _, data = wav.read(self.file_path, mmap=True)
+        return data
+
+
+class NullSink(OutputSink):
+
+    def write(self, block):
+        pass
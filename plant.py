@@ -0,0 +1,171 @@
+import numpy as np
+import scipy.io.wavfile as wav
+
+# Acoustic Plant -
+#   - Models the acoustic paths between the noise source and the error microphone (primary path) and between the
+#     controller's speaker and the error microphone (secondary path) as FIR impulse responses
+#
+# Room and headphone impulse responses are thousands of taps long, so they are applied with a zero-latency
+# partitioned convolution: the first partition of the impulse response is convolved directly, and the rest of it
+# (the tail) with uniformly partitioned overlap-save FFT convolution. The tail only depends on samples from earlier
+# partitions, so its contribution to the next partition is computed once per partition, and every block of
+# samples (of any length) is convolved as soon as it arrives.
+
+
+# Load an impulse response from a .npy file or a wav file (first channel, integer samples scaled to -1 to 1)
+def load_impulse_response(file_path):
+    if file_path.endswith(".npy"):
+        return np.asarray(np.load(file_path), dtype=np.float64).ravel()
+    _, data = wav.read(file_path)
+    if data.ndim > 1:
+        data = data[:, 0]
+    if np.issubdtype(data.dtype, np.integer):
+        return data / np.iinfo(data.dtype).max
+    return np.asarray(data, dtype=np.float64)
+
+
+# Generate a synthetic room impulse response: a direct path after delay samples, followed by an exponentially
+# decaying noise tail that drops by 60 dB after rt60 seconds
+#   - direct_gain / tail_gain: amplitudes of the direct path and of the start of the tail
+def synthetic_impulse_response(fs, length, rt60=0.3, delay=0, direct_gain=1.0, tail_gain=0.3, seed=0):
+    rng = np.random.default_rng(seed)
+    h = np.zeros(length)
+    if delay >= length:
+        return h
+    h[delay] = direct_gain
+    t = np.arange(length - delay - 1) / fs
+    h[delay + 1:] = tail_gain * rng.normal(size=len(t)) * np.exp(-6.9 * t / rt60)
+    return h
+
+
+class PartitionedConvolver:
+
+    # Constructor
+    #   - partition_size: length of the partitions the impulse response is split into. Larger partitions
+    #     cost less per sample for the FFT tail but more for the directly convolved head
+    def __init__(self, impulse_response, partition_size=256):
+        self.partition_size = partition_size
+        self.set_impulse_response(impulse_response)
+        self.reset()
+
+    # Change the impulse response (to one of the same length), keeping the input history, e.g. to update the
+    # weights of an adaptive filter (see controllers/fdaf.py). The head takes effect right away, and the tail from
+    # the next partition
+    def set_impulse_response(self, impulse_response):
+        self.impulse_response = np.asarray(impulse_response, dtype=np.float64)
+        P = self.partition_size
+
+        # Head, convolved directly (reversed, to convolve single samples with a dot product)
+        self.head = self.impulse_response[:P]
+        self.reversed_head = self.head[::-1]
+
+        # One spectrum per partition, the partitions after the head (the tail) are convolved in the frequency domain
+        self.num_partitions = max(1, -(-len(self.impulse_response) // P))
+        self.num_tail_partitions = self.num_partitions - 1
+        padded = np.zeros(self.num_partitions * P)
+        padded[:len(self.impulse_response)] = self.impulse_response
+        self.spectra = np.fft.rfft(padded.reshape(self.num_partitions, P), n=2 * P, axis=1)
+
+    def reset(self):
+        P = self.partition_size
+        self.head_history = np.zeros(len(self.head) - 1)
+        # Input samples of the previous and current partition (an overlap-save frame)
+        self.frame = np.zeros(2 * P)
+        self.position = 0
+        # Spectra of the most recent complete frames, newest first
+        self.frame_spectra = np.zeros((self.num_partitions, P + 1), dtype=complex)
+        # Tail contribution to the samples of the current partition, computed at the start of the partition
+        self.tail_output = np.zeros(P)
+        self.tail_pending = False
+
+    # Convolve the next block of input samples, returning the same number of output samples
+    def process(self, block):
+        block = np.asarray(block, dtype=np.float64)
+        output = np.empty(len(block))
+        P = self.partition_size
+
+        if len(block) == 1:
+            output[0] = self.process_sample(block[0])
+            return output
+
+        # Head - direct convolution over the whole block
+        extended = np.concatenate((self.head_history, block))
+        output[:] = np.convolve(extended, self.head, mode="valid") if len(self.head) > 1 else block * self.head[0]
+        if len(self.head_history) > 0:
+            self.head_history = extended[-len(self.head_history):]
+
+        # Tail - add the precomputed contribution, one partition at a time
+        start = 0
+        while start < len(block):
+            if self.tail_pending:
+                self.update_tail()
+            length = min(P - self.position, len(block) - start)
+            output[start:start + length] += self.tail_output[self.position:self.position + length]
+            self.frame[P + self.position:P + self.position + length] = block[start:start + length]
+            self.position += length
+            start += length
+
+            if self.position == P:
+                self.finish_partition()
+        return output
+
+    # Convolve a single input sample, returning its output sample (the same as process([sample])[0], without the
+    # cost of setting up a block)
+    def process_sample(self, sample):
+        if self.tail_pending:
+            self.update_tail()
+        output = self.head[0] * sample + self.tail_output[self.position]
+        if len(self.head_history) > 0:
+            output += np.dot(self.head_history, self.reversed_head[:-1])
+            self.head_history[:-1] = self.head_history[1:]
+            self.head_history[-1] = sample
+
+        self.frame[self.partition_size + self.position] = sample
+        self.position += 1
+        if self.position == self.partition_size:
+            self.finish_partition()
+        return output
+
+    # The current partition is complete, its frame joins the frames the tail of the next one is computed from
+    def finish_partition(self):
+        P = self.partition_size
+        self.frame_spectra = np.roll(self.frame_spectra, 1, axis=0)
+        self.frame_spectra[0] = np.fft.rfft(self.frame)
+        self.frame[:P] = self.frame[P:]
+        self.position = 0
+        self.tail_pending = True
+
+    # Tail contribution to the current partition, from the frames before it
+    def update_tail(self):
+        self.tail_pending = False
+        if self.num_tail_partitions > 0:
+            P = self.partition_size
+            spectrum = np.sum(self.frame_spectra[:-1] * self.spectra[1:], axis=0)
+            self.tail_output = np.fft.irfft(spectrum, n=2 * P)[P:]
+
+
+# Plant stage of a simulation (see simulation_core.py) with FIR primary and secondary paths
+class AcousticPlant:
+
+    # Constructor
+    #   - primary_path: impulse response from the noise source to the error microphone (None for no path)
+    #   - secondary_path: impulse response from the controller's speaker to the error microphone (None for no path)
+    def __init__(self, primary_path=None, secondary_path=None, partition_size=256):
+        self.primary_path = primary_path
+        self.secondary_path = secondary_path
+        self.primary = PartitionedConvolver(primary_path, partition_size) if primary_path is not None else None
+        self.secondary = PartitionedConvolver(secondary_path, partition_size) if secondary_path is not None else None
+
+    # Returns the (noise, controller output) blocks as they arrive at the error microphone
+    def process(self, inp, controller_output):
+        if np.ndim(inp) > 1 or np.ndim(controller_output) > 1:
+            raise ValueError("AcousticPlant only supports single channel simulations")
+        noise = self.primary.process(inp) if self.primary is not None else inp
+        anti_noise = self.secondary.process(controller_output) if self.secondary is not None else controller_output
+        return noise, anti_noise
+
+    def reset(self):
+        if self.primary is not None:
+            self.primary.reset()
+        if self.secondary is not None:
+            self.secondary.reset()
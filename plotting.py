@@ -0,0 +1,153 @@
+import atexit
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import scipy.signal
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Plotting -
+#   - Headless, decimated plots of simulation signals, rendered in the background
+#
+# Figures are drawn straight onto an Agg canvas (without pyplot), so plotting never opens a window or blocks, and
+# works on machines without a display. Long signals are decimated to a min/max envelope with one pair of points
+# per horizontal pixel of the figure before they are drawn, which looks the same as plotting every sample.
+# Spectrograms are computed once per signal and cached, instead of by matplotlib's specgram every time they are
+# plotted. The plots are rendered by a background worker thread (submit()), so the next simulation can start right
+# away; wait() blocks until every submitted plot has been saved (re-raising any error raised while rendering
+# one), and is also called when Python exits.
+
+DPI = 100
+
+# Number of spectrograms kept in the cache
+STFT_CACHE_SIZE = 16
+
+
+# Decimate a signal to a min/max envelope of num_buckets buckets, returning the (x, y) points to plot
+# Signals with fewer than 2 * num_buckets samples are returned as they are
+def envelope(signal, num_buckets):
+    signal = np.asarray(signal, dtype=float)
+    n = len(signal)
+    if n <= 2 * num_buckets:
+        return np.arange(n), signal
+
+    # Every bucket becomes a vertical line from its minimum to its maximum, at the middle of the bucket
+    edges = np.linspace(0, n, num_buckets + 1).astype(int)
+    minimums = np.minimum.reduceat(signal, edges[:-1])
+    maximums = np.maximum.reduceat(signal, edges[:-1])
+    x = np.repeat((edges[:-1] + edges[1:] - 1) / 2, 2)
+    y = np.empty(2 * num_buckets)
+    y[0::2] = minimums
+    y[1::2] = maximums
+    return x, y
+
+
+class STFTCache:
+
+    # Constructor
+    def __init__(self, size=STFT_CACHE_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+
+    # Spectrogram (frequencies, times, power) of signal, computed once per signal and parameters
+    def spectrogram(self, signal, fs, nfft=256, noverlap=128):
+        signal = np.ascontiguousarray(signal, dtype=float)
+        key = (hashlib.sha1(signal.tobytes()).hexdigest(), fs, nfft, noverlap)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        frequencies, times, power = scipy.signal.spectrogram(signal, fs, window="hann", nperseg=nfft,
+                                                              noverlap=noverlap, mode="psd")
+        self.entries[key] = (frequencies, times, power)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return frequencies, times, power
+
+
+stft_cache = STFTCache()
+
+
+# Amplitude plot of signals, each given as (signal, label, format), saved to file_path
+# Every channel of multichannel signals is plotted as its own line
+def plot_lines(file_path, title, signals, figsize=(12.5, 6), xlabel="Timestep", ylabel="Scaled Amplitude"):
+    figure = Figure(figsize=figsize, dpi=DPI)
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    num_buckets = int(figsize[0] * DPI)
+    for signal, label, fmt in signals:
+        signal = np.asarray(signal)
+        channels = [signal] if signal.ndim == 1 else [signal[:, c] for c in range(signal.shape[1])]
+        for channel, channel_signal in enumerate(channels):
+            x, y = envelope(channel_signal, num_buckets)
+            channel_label = label if len(channels) == 1 else f"{label} (channel {channel + 1})"
+            axes.plot(x, y, fmt, label=channel_label, linewidth=0.8, alpha=1 if channel == 0 else 0.6)
+    axes.set_title(title)
+    axes.set_xlabel(xlabel)
+    axes.set_ylabel(ylabel)
+    axes.legend()
+    figure.savefig(file_path)
+    return file_path
+
+
+# Grid of spectrograms of signals, each given as (signal, label), saved to file_path
+# Multichannel signals are mixed down to the mean of their channels
+#   - max_frequency: top of the frequency axis, in Hz
+def plot_spectrograms(file_path, signals, fs, max_frequency=10000, columns=2, figsize=(12, 8)):
+    rows = -(-len(signals) // columns)
+    figure = Figure(figsize=figsize, dpi=DPI)
+    FigureCanvasAgg(figure)
+    axs = figure.subplots(rows, columns, sharex=True, sharey=True, squeeze=False)
+
+    for i, (signal, label) in enumerate(signals):
+        axes = axs[i // columns, i % columns]
+        signal = np.asarray(signal)
+        if signal.ndim > 1:
+            signal = signal.mean(axis=1)
+        frequencies, times, power = stft_cache.spectrogram(signal, fs)
+        with np.errstate(divide="ignore"):
+            image = axes.pcolormesh(times, frequencies, 10 * np.log10(power), cmap="viridis", shading="auto")
+        axes.set_ylim(0, max_frequency)
+
+        # Add colorbar for amplitude
+        colorbar = figure.colorbar(image, ax=axes)
+        colorbar.set_label("Amplitude (dB)")
+        axes.set_ylabel("Frequency (Hz)")
+        axes.set_title(label)
+
+    for i, axes in enumerate(axs.flat):
+        axes.set_xlabel("Time (s)")
+        axes.set_visible(i < len(signals))
+    figure.savefig(file_path)
+    return file_path
+
+
+# Background worker that renders the plots, and the plots submitted to it since the last wait()
+_executor = None
+_pending = []
+
+
+# Render a plot in the background, returning a Future with the saved file path
+def submit(plot_function, *args, **kwargs):
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="plotting")
+    future = _executor.submit(plot_function, *args, **kwargs)
+    _pending.append(future)
+    return future
+
+
+# Wait until every submitted plot has been saved, re-raising the first error raised while rendering one
+def wait():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    futures = list(_pending)
+    _pending.clear()
+    for future in futures:
+        future.result()
+
+
+atexit.register(wait)
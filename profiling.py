@@ -0,0 +1,185 @@
+import json
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Profiling -
+#   - Per-stage timers for simulations, to see where the time of a run goes
+#
+# A Profiler keeps the cumulative time and number of calls of every named stage, and the count, total, minimum and
+# maximum of every named value recorded with record(). SimulationCore.simulate(profile=True) times its own stages
+# (controller, plant, sensor, monitor, sink, checkpoints, writing the wav file and plotting), along with the
+# samples/sec of the run and its peak memory, and writes the report as JSON. Stages can be nested, and the time of a nested stage is
+# also counted in the stages around it (e.g. "controller.input" is part of "controller").
+#
+# Controllers (or any other code) can add their own stages and values through the module level hooks, which go to
+# the active profiler:
+#
+#   from profiling import stage, record
+#   with stage("my_controller.update"):
+#       ...
+#   record("my_controller.weight_norm", np.linalg.norm(w))
+#
+# When no profiler is active the hooks go to NullProfiler, which does nothing, so they cost effectively nothing.
+
+
+class NullProfiler:
+
+    enabled = False
+
+    def stage(self, name):
+        return NULL_STAGE
+
+    def record(self, name, value):
+        pass
+
+    # Returns function unchanged (Profiler returns it wrapped in a timer)
+    def timed(self, name, function):
+        return function
+
+
+# Reusable context manager that does nothing
+class NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+class Stage:
+
+    # Constructor
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, time.perf_counter() - self.start_time)
+        return False
+
+
+class Profiler:
+
+    enabled = True
+
+    # Constructor
+    #   - trace_memory: measure peak memory with tracemalloc (Python allocations made during the run, slows the run
+    #     down), instead of the peak resident memory of the process
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.times = {}
+        self.calls = {}
+        self.values = {}
+        self.previous = None
+        self.start_time = None
+        self.seconds = 0.0
+        self.peak_memory = None
+
+    # Make this the profiler the module level hooks go to, and start timing the run
+    def __enter__(self):
+        global _active
+        self.previous = _active
+        _active = self
+        if self.trace_memory:
+            tracemalloc.start()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        self.seconds += time.perf_counter() - self.start_time
+        if self.trace_memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        elif resource is not None:
+            # ru_maxrss is in kilobytes on Linux
+            self.peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        _active = self.previous
+        return False
+
+    # Add time spent in a stage
+    def add(self, name, seconds, calls=1):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    # Time a stage, as a context manager
+    def stage(self, name):
+        return Stage(self, name)
+
+    # Record a value, keeping its count, total, minimum and maximum
+    def record(self, name, value):
+        value = float(value)
+        stats = self.values.get(name)
+        if stats is None:
+            self.values[name] = {"count": 1, "total": value, "min": value, "max": value}
+        else:
+            stats["count"] += 1
+            stats["total"] += value
+            stats["min"] = min(stats["min"], value)
+            stats["max"] = max(stats["max"], value)
+
+    # Wrap function in a timer for the stage name
+    def timed(self, name, function):
+        def timed_function(*args, **kwargs):
+            start_time = time.perf_counter()
+            result = function(*args, **kwargs)
+            self.add(name, time.perf_counter() - start_time)
+            return result
+        return timed_function
+
+    # Report of the run as a dictionary
+    #   - num_samples: number of samples processed, for the samples/sec throughput
+    def report(self, num_samples=None, **info):
+        stages = {}
+        for name in sorted(self.times, key=self.times.get, reverse=True):
+            stages[name] = {
+                "seconds": self.times[name],
+                "calls": self.calls[name],
+                "fraction": self.times[name] / self.seconds if self.seconds > 0 else 0.0,
+            }
+        report = dict(info)
+        report["seconds"] = self.seconds
+        if num_samples is not None:
+            report["samples"] = num_samples
+            report["samples_per_second"] = num_samples / self.seconds if self.seconds > 0 else float("inf")
+        report["peak_memory_bytes"] = self.peak_memory
+        report["stages"] = stages
+        report["values"] = {name: dict(stats, mean=stats["total"] / stats["count"]) for name, stats in self.values.items()}
+        return report
+
+    def write_json(self, file_path, num_samples=None, **info):
+        with open(file_path, "w") as report_file:
+            json.dump(self.report(num_samples, **info), report_file, indent=2)
+        return file_path
+
+
+NULL_PROFILER = NullProfiler()
+_active = NULL_PROFILER
+
+
+# Profiler the hooks currently go to (NULL_PROFILER when profiling is disabled)
+def current():
+    return _active
+
+
+# Time a stage with the active profiler
+def stage(name):
+    return _active.stage(name)
+
+
+# Record a value with the active profiler
+def record(name, value):
+    _active.record(name, value)
@@ -0,0 +1,180 @@
+import time
+import numpy as np
+
+# Real-Time Streaming -
+#   - Runs a simulation the way it would run against an audio device: blocks of block_size samples arrive on a
+#     wall clock schedule at the sample rate fs, and every block has to be processed before its deadline
+#
+# LoopbackDevice stands in for the audio device so streaming runs headless: its capture side plays the
+# simulation's source (the wav files) in real time, and its playback side writes the error microphone signal to
+# an output sink (see output_sink.py). A block of samples arrives once its last sample has been captured, so the
+# earliest it can be played back is one block duration after its first sample. The deadline of a block (by default
+# one block duration, when the next block arrives) is measured from its arrival, and a block that starts late
+# because the previous ones overran counts against it too, like it would on the device.
+#
+# RealTimeReport keeps the processing time, start and finish time of every block, and reports deadline misses,
+# processing time histograms and end-to-end latency (from capture of the first sample of a block to playback).
+# Loading and compiling the controller (e.g. the Numba kernels) is done before the device starts capturing, and
+# reported as the warm-up time, so the blocks measure steady-state processing.
+
+
+# Wait until time.perf_counter() reaches wake_time. Sleeping alone overshoots by a scheduler tick, so the last
+# spin_time seconds are spent spinning
+def wait_until(wake_time, spin_time=0.001):
+    remaining = wake_time - time.perf_counter()
+    if remaining > spin_time:
+        time.sleep(remaining - spin_time)
+    while time.perf_counter() < wake_time:
+        pass
+
+
+class LoopbackDevice:
+
+    # Constructor
+    #   - source: source stage of a simulation (see simulation_core.py), captured by the device
+    #   - sink: OutputSink that receives the blocks played back by the device
+    #   - paced: hand out blocks on the wall clock schedule (True), or as soon as they are asked for (False)
+    def __init__(self, source, block_size, sink, paced=True):
+        self.source = source
+        self.fs = source.fs
+        self.block_size = block_size
+        self.sink = sink
+        self.paced = paced
+        self.start_time = None
+
+    def open(self):
+        self.sink.open(self.source.n, self.fs, self.source.channels)
+        self.start_time = time.perf_counter()
+
+    # Time since the device was opened, in seconds
+    def now(self):
+        return time.perf_counter() - self.start_time
+
+    # Captured blocks of (input, reference) samples, with the time the block arrived (its last sample was captured)
+    def capture(self):
+        captured = 0
+        for inp, reference in self.source.frames(self.block_size):
+            captured += len(inp)
+            arrival = captured / self.fs
+            if self.paced:
+                wait_until(self.start_time + arrival)
+            yield inp, reference, arrival
+
+    # Play back a block of samples
+    def play(self, block):
+        self.sink.write(block)
+
+    def close(self):
+        return self.sink.close()
+
+
+class RealTimeReport:
+
+    # Constructor
+    #   - block_duration: length of a block, in seconds
+    #   - deadline: time a block has to be processed in after it arrives, in seconds
+    def __init__(self, fs, block_size, deadline=None):
+        self.fs = fs
+        self.block_size = block_size
+        self.block_duration = block_size / fs
+        self.deadline = deadline if deadline is not None else self.block_duration
+        self.block_lengths = []
+        self.arrivals = []
+        self.starts = []
+        self.finishes = []
+
+        # Time spent warming up the controller before the stream started (see SimulationCore.warm_up()), in seconds
+        self.warm_up_time = 0.0
+
+    # Record one processed block
+    #   - arrival, start, finish: when the block arrived, and when its processing started and finished (in seconds)
+    def record(self, block_length, arrival, start, finish):
+        self.block_lengths.append(block_length)
+        self.arrivals.append(arrival)
+        self.starts.append(start)
+        self.finishes.append(finish)
+
+    # Time the previous block finished, or 0 before the first block
+    @property
+    def last_finish(self):
+        return self.finishes[-1] if self.finishes else 0.0
+
+    @property
+    def num_blocks(self):
+        return len(self.finishes)
+
+    # Time spent processing every block, in seconds
+    @property
+    def processing_times(self):
+        return np.array(self.finishes) - np.array(self.starts)
+
+    # Time every block finished after it arrived (including waiting for the previous blocks), in seconds
+    @property
+    def response_times(self):
+        return np.array(self.finishes) - np.array(self.arrivals)
+
+    # End-to-end latency of every block, from capture of its first sample to playback, in seconds
+    @property
+    def latencies(self):
+        return np.array(self.finishes) - (np.array(self.arrivals) - np.array(self.block_lengths) / self.fs)
+
+    @property
+    def deadline_misses(self):
+        return int(np.sum(self.response_times > self.deadline))
+
+    @property
+    def miss_rate(self):
+        return self.deadline_misses / self.num_blocks if self.num_blocks > 0 else 0.0
+
+    # Fraction of the available time spent processing (above 1 the controller can't keep up)
+    @property
+    def load(self):
+        return float(np.sum(self.processing_times) / self.arrivals[-1]) if self.num_blocks > 0 else 0.0
+
+    # Histogram of the processing times, as (counts, bin edges in seconds)
+    #   - bins: number of log-spaced bins between the shortest and the longest processing time, or the bin edges
+    def histogram(self, bins=20):
+        times = self.processing_times
+        if np.isscalar(bins) and len(times) > 0:
+            low = max(np.min(times), 1e-9)
+            high = max(np.max(times), low * 1.01)
+            bins = np.geomspace(low, high, bins + 1)
+        return np.histogram(times, bins=bins)
+
+    # Summary of the run, in seconds
+    def as_dict(self):
+        processing_times = self.processing_times
+        latencies = self.latencies
+        percentiles = lambda values: {f"p{p}": float(np.percentile(values, p)) if len(values) > 0 else 0.0 for p in (50, 90, 99)}
+        return {
+            "fs": self.fs,
+            "block_size": self.block_size,
+            "blocks": self.num_blocks,
+            "deadline": self.deadline,
+            "warm_up_time": self.warm_up_time,
+            "deadline_misses": self.deadline_misses,
+            "miss_rate": self.miss_rate,
+            "load": self.load,
+            "processing_time": {"mean": float(np.mean(processing_times)) if len(processing_times) > 0 else 0.0,
+                                "max": float(np.max(processing_times)) if len(processing_times) > 0 else 0.0,
+                                **percentiles(processing_times)},
+            "latency": {"max": float(np.max(latencies)) if len(latencies) > 0 else 0.0, **percentiles(latencies)},
+        }
+
+    # Print the summary and the processing time histogram
+    def print_report(self, bins=20):
+        summary = self.as_dict()
+        print(f"Real-time run: {summary['blocks']} blocks of {self.block_size} samples at {self.fs} Hz, "
+              f"deadline {self.deadline * 1e6:.1f} us, warm-up {self.warm_up_time * 1e3:.1f} ms")
+        print(f"Deadline misses: {summary['deadline_misses']} ({summary['miss_rate'] * 100:.2f}%), load {summary['load'] * 100:.1f}%")
+        for name in ("processing_time", "latency"):
+            print(f"{name.replace('_', ' ').capitalize()} (us): " +
+                  ", ".join(f"{key} {value * 1e6:.1f}" for key, value in summary[name].items()))
+
+        if self.num_blocks == 0:
+            return
+        counts, edges = self.histogram(bins)
+        width = 40 / max(np.max(counts), 1)
+        for count, low, high in zip(counts, edges[:-1], edges[1:]):
+            marker = "!" if high > self.deadline else " "
+            print(f"{low * 1e6:>10.1f} - {high * 1e6:>10.1f} us {marker} {'#' * int(np.ceil(count * width)):<40} {count}")
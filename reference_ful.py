@@ -1,148 +1,58 @@
-from distutils.log import error
 import numpy as np
-import matplotlib.pyplot as plt
-import scipy.io.wavfile as wav
-import padasip as pa
+import plotting
+from wav_source import WavSource
+from monitor import reference_ratio
+from controllers.controller import FEED_REFERENCE
+from simulation_core import SimulationCore, NoisyReferenceSource
 
-class ReferenceFul:
+# Referenceful Simulation -
+#   - The controller hears the background noise combined with the reference signal (e.g. music), and is fed the
+#     reference signal forward, so it can learn to cancel everything but the reference
+class ReferenceFul(SimulationCore):
 
     # Constructor
-    def __init__(self, noise_file_path, reference_file_path, controller, num_timesteps = 400000):
+    #   - block_size: number of samples handed to the controller at a time
+    #   - noise_peak / reference_peak: peak absolute values used to normalize the wav files, found from the files if None
+    #   - plant: acoustic paths to the error microphone (see plant.py), the signals arrive unchanged if None
+    #   - cache: SignalCache (or True for the default one) to load the wav files from, see signal_cache.py
+    def __init__(self, noise_file_path, reference_file_path, controller, num_timesteps = 400000, block_size = 1, noise_peak = None, reference_peak = None, plant = None, cache = None):
+        # Stream the background noise and reference wav files, scaled from -1 to 1
         self.noise_file_path = noise_file_path
-        self.fs, self.input_noise = wav.read(self.noise_file_path)
-        self.n = num_timesteps
-        
-        # If the noise is 2D, convert it to 1D
-        self.input_noise = self.input_noise.ravel()
-        # Preprocess input background noise for signal processing by scaling from -1 to 1
-        self.input_noise = self.input_noise / np.max(np.abs(self.input_noise))
-        self.input_noise = self.input_noise[:self.n]
+        self.noise_source = WavSource(self.noise_file_path, num_timesteps, peak=noise_peak, cache=cache)
 
         self.reference_file_path = reference_file_path
-        _, self.reference_noise = wav.read(self.reference_file_path)
-        
-        # If the noise is 2D, convert it to 1D
-        self.reference_noise = self.reference_noise.ravel()
-        # Preprocess reference noise for signal processing by scaling from -1 to 1
-        self.reference_noise = self.reference_noise / np.max(np.abs(self.reference_noise))
-        self.reference_noise = self.reference_noise[:self.n]
-
-        # Combine background noise file with reference file to make "noisy" simulation atmosphere
-        # Essentially, combine background chatter with reference music
-        self.input_noise = self.input_noise + self.reference_noise
-
-        self.controller = controller
-
-        # Liveness monitor
-        self.monitor_window_size = 1000
-        self.monitor_liveness_value = .1
-
-    # Simulation step
-    def simulate(self, output_file_name="output", new_controller=None):
-        if new_controller != None:
-            self.controller = new_controller
-        
-        print(f"Simulating for {self.n} timesteps with {self.controller.name}")
-
-        error_mic = list(np.zeros(self.n))
-        error_values = np.zeros(self.monitor_window_size)
-        liveness_is_satisfied = False
-        for i in range(self.n):
-            # Safety should always be satisfied if Python is deterministic ;)
-            safety_is_satisfied = False
-
-            # measure input source wav
-            inp = self.input_noise[i]
-
-            # Send input source to controller
-            controller_output = self.controller.input(inp)
-            safety_is_satisfied = True
-
-            # Error microphone convolves signals from controller and original source
-            error_microphone = inp + controller_output
-            error_mic[i] = error_microphone
-
-            # Monitor for liveness
-            error_values =  np.append(error_values, abs(1 - abs(error_mic[i] / self.reference_noise[i])) / 100 if self.reference_noise[i] != 0 else 1)
-            error_values = error_values[1:]
-
-            # Only check monitor once liveness window is filled, and only check it once
-            if i >= self.monitor_window_size and liveness_is_satisfied == False and np.average(error_values) < self.monitor_liveness_value:
-                liveness_is_satisfied = True
-
-            # Feed Foward Step -
-            # Send reference signal back to speaker
-            # Allows controller to learn if it would like
-            # Because this is reference-ful cancelling, send the reference signal
-            self.controller.feed_forward(self.reference_noise[i])
-
-            # Double check safety monitor
-            if not safety_is_satisfied:
-                print(f"Safety was not satisfied while simulating for {self.controller.name}, stopping simulation")
-                break
-        # Write output
-        wav.write(f"{output_file_name}.wav", self.fs, np.array(error_mic))
-
-        # Generate plots
-        self.plot_errors(error_mic, output_file_name)
-
-        # Report monitor findings
-        if liveness_is_satisfied:
-            print(f"Liveness was satisfied for Controller : {self.controller.name}")
-        else:
-            print(f"Liveness was NOT satisfied for Controller : {self.controller.name}")
-        
-        # Set MSE between error_mic and reference signal
-        self.mse = (np.square(self.reference_noise - error_mic)).mean()
-        print(f"MSE for {self.controller.name} was {self.mse}")
-
-        return error_mic
-
-    # Plot reference noise to cancelled noise (ie, error microphone)
+        self.reference_source = WavSource(self.reference_file_path, num_timesteps, peak=reference_peak, cache=cache)
+
+        # Feed Foward Step -
+        # Send reference signal back to speaker
+        # Allows controller to learn if it would like
+        # Because this is reference-ful cancelling, send the reference signal
+        # Liveness is monitored over a sliding window
+        super().__init__(NoisyReferenceSource(self.noise_source, self.reference_source), controller, FEED_REFERENCE,
+                         block_size, plant, monitor_window_size=1000, monitor_liveness_value=.1, monitor_ratio=reference_ratio)
+
+    # Reference noise, read from the reference wav file
+    @property
+    def reference_noise(self):
+        return self.reference_source.read(0, self.n)
+
+    # Combine background noise file with reference file to make "noisy" simulation atmosphere
+    # Essentially, combine background chatter with reference music (a mono file is played on every channel of a
+    # multichannel one, like the simulation hears it)
+    @property
+    def input_noise(self):
+        inp, _ = next(self.source.frames(self.n))
+        return inp
+
+    # Plot reference noise to cancelled noise (ie, error microphone), rendered in the background (see plotting.py)
     def plot_errors(self, error, output_file_name):
-        plt.figure(figsize=(12.5,6))
-        max_val = max(error)
-        error_plt = [v / max_val for v in error]
-        plt.plot(self.input_noise, "g", label="original noisy signal")
-        plt.plot(error_plt, "b", label="error microphone")
-        plt.plot(self.reference_noise, "r", label="reference signal")
-        plt.title(f"ReferenceLess Simulation with {self.controller.name}")
-        plt.xlabel("Timestep")
-        plt.ylabel("Scaled Amplitude")
-        plt.legend()
-        plt.savefig(f"{output_file_name}-ful.png")
-    
-    def plot_signals(self, signals, output_file_name="reference-ful-output"):
-        num_signals = len(signals)
-
-        # Create a subplot grid with 2 rows and 2 columns
-        fig, axs = plt.subplots(2, 2, figsize=(12, 8), sharex=True, sharey=True)
-
-        for i in range(num_signals):
-            row = i // 2  # Calculate the row index
-            col = i % 2   # Calculate the column index
+        error_plt = error / np.max(error)
+        return plotting.submit(plotting.plot_lines, f"{output_file_name}-ful.png",
+                               f"ReferenceLess Simulation with {self.controller.name}",
+                               [(self.input_noise, "original noisy signal", "g"), (error_plt, "error microphone", "b"),
+                                (self.reference_noise, "reference signal", "r")])
 
-            # Calculate the spectrogram for each signal
-            f, t, Sxx, im = axs[row, col].specgram(signals[i][0], Fs=self.fs, cmap='viridis', aspect='auto')#, vmin=0, vmax=np.max(np.abs(signals[i])))
-
-            # Set the frequency range to 0-10000 Hz
-            axs[row, col].set_ylim(0, 10000)
-
-            # Add colorbar for amplitude
-            cbar = fig.colorbar(im, ax=axs[row, col])
-            cbar.set_label('Amplitude')
-
-            # Label axes
-            axs[row, col].set_ylabel(f'Frequency (Hz)')
-            axs[row, col].set_title(signals[i][1])
-
-        # Label common x-axis
-        axs[-1, 0].set_xlabel('Time (s)')
-        axs[-1, 1].set_xlabel('Time (s)')
-        axs[-2, 0].set_xlabel('Time (s)')
-        axs[-2, 1].set_xlabel('Time (s)')
-
-        # Save or display the plot
-        plt.savefig(f"{output_file_name}_spectrograms.png")
-        plt.show()
-            
+    # Plot the spectrogram of every signal, rendered in the background (see plotting.py)
+    def plot_signals(self, signals, output_file_name="reference-ful-output"):
+        return plotting.submit(plotting.plot_spectrograms, f"{output_file_name}_spectrograms.png",
+                               [(signal[0], signal[1]) for signal in signals], self.fs)
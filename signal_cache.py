@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+import numpy as np
+import scipy.io.wavfile as wav
+
+# Signal Cache -
+#   - Decoded, normalized float32 signals of wav files, kept across simulations and across runs
+#
+# Building a simulation normally streams the wav file and finds its peak with a pass over the whole file. With a
+# cache, the file is decoded and normalized once, and the signal is stored:
+#   - in memory, for the simulations built later in the same process, up to max_bytes of decoded signals (the
+#     least recently used ones are dropped first). Signals memory-mapped from disk don't count against max_bytes
+#   - on disk as a .npy file in directory, which later runs memory-map instead of decoding the wav file again
+#
+# Signals are keyed on the wav file's path, modification time and size (so an edited file is decoded again), how
+# its channels are handled and the peak it is normalized by. The cache directory defaults to $ANC_SIGNAL_CACHE, or
+# ~/.cache/anc/signals. Old entries on disk are never cleaned up, delete the directory to clear the cache.
+
+DEFAULT_DIRECTORY = os.environ.get("ANC_SIGNAL_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "anc", "signals"))
+
+# How the channels of multichannel files are handled: kept as an (n, channels) signal, only the first channel,
+# or mixed down to the mean of the channels
+CHANNEL_MODES = ("keep", "first", "mix")
+
+
+# Decode a wav file into its sample rate and float64 signal, according to channels (see CHANNEL_MODES)
+def decode(file_path, channels="keep"):
+    fs, data = wav.read(file_path)
+    if data.ndim > 1:
+        if channels == "first":
+            data = data[:, 0]
+        elif channels == "mix":
+            data = np.mean(data, axis=1)
+    return fs, np.asarray(data, dtype=np.float64)
+
+
+class SignalCache:
+
+    # Constructor
+    #   - directory: where signals are stored on disk, or None to only keep them in memory
+    #   - max_bytes: memory budget of the decoded signals kept in memory (memory-mapped signals aren't counted)
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+
+    # Only the settings are sent to worker processes, not the signals kept in memory
+    def __getstate__(self):
+        return {"directory": self.directory, "max_bytes": self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def key(self, file_path, channels, peak):
+        status = os.stat(file_path)
+        return (os.path.abspath(file_path), status.st_mtime_ns, status.st_size, channels, None if peak is None else float(peak))
+
+    # Sample rate and normalized float32 signal of a wav file, and the peak it was normalized by
+    #   - channels: how the channels of multichannel files are handled (see CHANNEL_MODES)
+    #   - peak: peak absolute value to normalize by, the file's own peak if None
+    def load(self, file_path, channels="keep", peak=None):
+        if channels not in CHANNEL_MODES:
+            raise ValueError(f"Unknown channel mode {channels}, expected one of {CHANNEL_MODES}")
+        key = self.key(file_path, channels, peak)
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        entry = self.load_from_disk(key)
+        if entry is None:
+            entry = self.decode(file_path, channels, peak)
+            self.save_to_disk(key, entry)
+        self.remember(key, entry)
+        return entry
+
+    # Decode and normalize the wav file
+    def decode(self, file_path, channels, peak):
+        fs, signal = decode(file_path, channels)
+        if peak is None:
+            peak = float(np.max(np.abs(signal))) if len(signal) > 0 else 1.0
+        return fs, (signal / peak).astype(np.float32), peak
+
+    # Bytes of memory a signal counts against the memory budget. Memory-mapped signals are paged in from the .npy
+    # file by the OS as they are read, so they aren't counted
+    @staticmethod
+    def memory_bytes(signal):
+        return 0 if isinstance(signal, np.memmap) else signal.nbytes
+
+    # Keep an entry in memory, dropping the least recently used ones to stay within the memory budget
+    def remember(self, key, entry):
+        num_bytes = self.memory_bytes(entry[1])
+        if num_bytes > self.max_bytes:
+            return
+        self.entries[key] = entry
+        self.num_bytes += num_bytes
+        while self.num_bytes > self.max_bytes:
+            _, (_, signal, _) = self.entries.popitem(last=False)
+            self.num_bytes -= self.memory_bytes(signal)
+
+    def file_path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def load_from_disk(self, key):
+        if self.directory is None:
+            return None
+        file_path = self.file_path(key)
+        try:
+            with open(f"{file_path}.json") as info_file:
+                info = json.load(info_file)
+            return info["fs"], np.load(f"{file_path}.npy", mmap_mode="r"), info["peak"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    # Store an entry on disk, written to temporary files first so other processes never see half written ones
+    def save_to_disk(self, key, entry):
+        if self.directory is None:
+            return
+        fs, signal, peak = entry
+        os.makedirs(self.directory, exist_ok=True)
+        file_path = self.file_path(key)
+        temporary_path = f"{file_path}.{os.getpid()}.tmp"
+        np.save(f"{temporary_path}.npy", signal)
+        with open(f"{temporary_path}.json", "w") as info_file:
+            json.dump({"file_path": key[0], "channels": key[3], "fs": fs, "peak": peak}, info_file)
+        os.replace(f"{temporary_path}.npy", f"{file_path}.npy")
+        os.replace(f"{temporary_path}.json", f"{file_path}.json")
+
+    # Drop every signal kept in memory
+    def clear(self):
+        self.entries.clear()
+        self.num_bytes = 0
+
+
+_default_cache = None
+
+
+# Signal cache shared by every simulation of the process, in DEFAULT_DIRECTORY
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = SignalCache()
+    return _default_cache
@@ -0,0 +1,380 @@
+import copy
+import time
+import numpy as np
+import scipy.io.wavfile as wav
+import profiling
+import checkpoint
+from controllers.controller import FEED_REFERENCE, FEED_ERROR
+from monitor import LivenessMonitor
+from output_sink import ArraySink, WavSink
+from realtime import LoopbackDevice, RealTimeReport
+from controllers.multichannel import MultichannelController
+
+# Simulation Core -
+#   - Runs a simulation as a pipeline of stages, one block of samples at a time:
+#
+#       source -> controller -> plant -> sensor -> monitor -> sink
+#
+#   - source: yields blocks of (input, reference) samples (reference is None when the simulation has none)
+#   - controller: produces the cancelling signal for every input block (see controllers/controller.py)
+#   - plant: carries the input noise and the controller output to the error microphone (IdentityPlant by default,
+#     see plant.py for FIR acoustic paths)
+#   - sensor: the error microphone, combines the two signals arriving from the plant
+#   - monitor: checks liveness and keeps the running metrics (see monitor.py)
+#   - sink: receives the error microphone signal (see output_sink.py)
+#
+# What is fed forward to the controller is set by feed: FEED_REFERENCE sends the reference signal (Referenceful),
+# FEED_ERROR sends the error microphone signal (Referenceless) and FEED_NONE sends nothing (Filtered).
+#
+# With a plant other than the identity, a FEED_ERROR controller can't work out the error microphone signal from its
+# own output, so it is handed every block in two steps: process_block() produces the controller output, and once the
+# plant and sensor have measured the error microphone, feed_forward_block() feeds it back (the controller gets the
+# errors of a block after its whole output block, which is the same as per-sample feedback with block_size 1).
+#
+# The simulation classes (ReferenceFul, ReferenceLess, Filtered) are configurations of the core. If the controller
+# declares it supports it (Controller.supports_vectorized()), the core hands it blocks of fast_block_size samples
+# instead of block_size, since the results are the same either way.
+#
+# Recordings with more than one channel are processed as (samples, channels) blocks. Unless the controller handles
+# them itself (Controller.multichannel), it is replaced by a MultichannelController running an independent copy of
+# it on every channel (see controllers/multichannel.py), and the error microphone signal has the same channels.
+#
+# With a checkpoint_file, simulate() saves the state of the run (see checkpoint.py) every checkpoint_interval seconds
+# and at the end, and resume() continues a run from its last checkpoint, on a simulation built the same way.
+#
+# stream() runs the same pipeline in real time against a loopback audio device instead (see realtime.py), to check
+# whether the controller keeps up with the sample rate.
+
+
+# Source stage of simulations with a single noise recording
+class NoiseSource:
+
+    # Constructor
+    def __init__(self, source):
+        self.source = source
+        self.fs = source.fs
+        self.n = len(source)
+        self.channels = source.channels
+
+    # Blocks of block_size samples, from sample start on
+    def frames(self, block_size, start=0):
+        for inp in self.source.frames(block_size, start, stop=self.n):
+            yield inp, None
+
+
+# Source stage of Referenceful simulations, the background noise combined with the reference
+class NoisyReferenceSource:
+
+    # Constructor
+    def __init__(self, noise_source, reference_source):
+        self.noise_source = noise_source
+        self.reference_source = reference_source
+        self.fs = noise_source.fs
+        self.n = min(len(noise_source), len(reference_source))
+
+        # A mono recording is played on every channel of a multichannel one
+        if 1 < noise_source.channels != reference_source.channels > 1:
+            raise ValueError(f"Noise and reference have different numbers of channels "
+                             f"({noise_source.channels} and {reference_source.channels})")
+        self.channels = max(noise_source.channels, reference_source.channels)
+
+    # Blocks of block_size samples, from sample start on
+    def frames(self, block_size, start=0):
+        noise_frames = self.noise_source.frames(block_size, start, stop=self.n)
+        reference_frames = self.reference_source.frames(block_size, start, stop=self.n)
+        for noise, reference in zip(noise_frames, reference_frames):
+            if self.channels > 1:
+                noise = noise.reshape(len(noise), -1)
+                reference = np.broadcast_to(reference.reshape(len(reference), -1), noise.shape[:1] + (self.channels,))
+            # Combine background noise file with reference file to make "noisy" simulation atmosphere
+            yield noise + reference, reference
+
+
+# Plant stage where the noise and the controller output reach the error microphone unchanged
+class IdentityPlant:
+
+    # Returns the (noise, controller output) blocks as they arrive at the error microphone
+    def process(self, inp, controller_output):
+        return inp, controller_output
+
+    def reset(self):
+        pass
+
+
+# Sensor stage, the error microphone adds up the noise and the controller output
+class ErrorMicrophone:
+
+    def measure(self, noise, anti_noise):
+        return noise + anti_noise
+
+
+class SimulationCore:
+
+    # Number of samples handed at once to controllers that support vectorized processing
+    fast_block_size = 65536
+
+    # Constructor
+    #   - monitor_ratio, monitor_sliding: liveness value function and window type of the monitor (see monitor.py)
+    def __init__(self, source, controller, feed, block_size=1, plant=None, sensor=None,
+                 monitor_window_size=1000, monitor_liveness_value=0.1, monitor_ratio=None, monitor_sliding=True):
+        self.source = source
+        self.fs = source.fs
+        self.n = source.n
+        self.channels = source.channels
+        self.controller = controller
+        self.feed = feed
+        self.block_size = block_size
+        self.plant = plant if plant is not None else IdentityPlant()
+        self.sensor = sensor if sensor is not None else ErrorMicrophone()
+
+        # Liveness monitor
+        self.monitor_window_size = monitor_window_size
+        self.monitor_liveness_value = monitor_liveness_value
+        self.monitor_ratio = monitor_ratio
+        self.monitor_sliding = monitor_sliding
+
+    # Controller that handles every channel of the simulation
+    #   - channel_threads: threads processing the channels in parallel, when the controller is copied per channel
+    def channel_controller(self, controller, channel_threads=None):
+        if self.channels > 1 and not controller.multichannel:
+            return MultichannelController.replicate(controller, self.channels, channel_threads)
+        return controller
+
+    # Monitor stage for one simulation run
+    def create_monitor(self):
+        return LivenessMonitor(self.monitor_window_size, self.monitor_liveness_value, self.monitor_ratio, self.monitor_sliding)
+
+    # Whether the error microphone has to be fed back to the controller after every block (see above)
+    def delayed_feedback(self):
+        return self.feed == FEED_ERROR and not isinstance(self.plant, IdentityPlant)
+
+    # Number of samples handed to the controller at a time
+    def run_block_size(self):
+        if not self.delayed_feedback() and self.controller.supports_vectorized(self.feed):
+            return max(self.block_size, self.fast_block_size)
+        return self.block_size
+
+    # Run one block through the controller, plant and sensor
+    # Returns the error microphone block and the input noise block as it arrived at the error microphone
+    def step(self, inp, reference):
+        profiler = profiling.current()
+
+        # Send input source to controller, along with what it is fed forward
+        with profiler.stage("controller"):
+            if self.feed == FEED_REFERENCE:
+                controller_output = self.controller.process_block(inp, reference)
+            elif self.feed == FEED_ERROR and not self.delayed_feedback():
+                controller_output = self.controller.process_block(inp, feedback=True)
+            else:
+                controller_output = self.controller.process_block(inp)
+
+        # Error microphone convolves signals from controller and original source
+        with profiler.stage("plant"):
+            noise, anti_noise = self.plant.process(inp, controller_output)
+        with profiler.stage("sensor"):
+            error_microphone = self.sensor.measure(noise, anti_noise)
+
+        if self.delayed_feedback():
+            with profiler.stage("controller"):
+                self.controller.feed_forward_block(error_microphone)
+        return error_microphone, noise
+
+    # Simulation step
+    #   - sink: OutputSink that receives the error microphone signal (see output_sink.py). By default the signal is
+    #     kept in an array, written to output_file_name.wav and returned, otherwise whatever the sink's close() returns
+    #   - plot: generate plots of the error microphone signal (rendered in the background, see plotting.py)
+    #   - profile: time the stages of the run (True, or a profiling.Profiler to use), and write the report to
+    #     output_file_name-profile.json (see profiling.py)
+    #   - channel_threads: with multichannel recordings, threads processing the channels in parallel
+    #   - checkpoint_file, checkpoint_interval: save a checkpoint of the run to checkpoint_file every
+    #     checkpoint_interval seconds and at the end, to resume() it from (see checkpoint.py)
+    def simulate(self, output_file_name="output", new_controller=None, sink=None, plot=True, profile=False,
+                 channel_threads=None, checkpoint_file=None, checkpoint_interval=60.0):
+        if new_controller != None:
+            self.controller = new_controller
+        self.controller = self.channel_controller(self.controller, channel_threads)
+        checkpointer = checkpoint.Checkpointer(checkpoint_file, checkpoint_interval) if checkpoint_file else None
+        return self.profiled_run(output_file_name, sink, plot, profile, checkpointer)
+
+    # Continue a run from its last checkpoint (see simulate()), on a simulation built like the one that was
+    # checkpointed (with the same files and the same controller parameters). New checkpoints go to the same file
+    def resume(self, checkpoint_file, output_file_name="output", sink=None, plot=True, profile=False,
+               channel_threads=None, checkpoint_interval=60.0):
+        state = checkpoint.load(checkpoint_file)
+        expected = {"name": type(self).__name__, "n": self.n, "channels": self.channels}
+        for key, value in expected.items():
+            if state[f"simulation/{key}"].item() != value:
+                raise ValueError(f"Checkpoint {checkpoint_file} is of a different simulation "
+                                 f"({key} {state[f'simulation/{key}'].item()}, expected {value})")
+
+        self.controller = self.channel_controller(self.controller, channel_threads)
+        self.controller.set_state(checkpoint.part(state, "controller"))
+        checkpointer = checkpoint.Checkpointer(checkpoint_file, checkpoint_interval)
+        return self.profiled_run(output_file_name, sink, plot, profile, checkpointer, state)
+
+    def profiled_run(self, output_file_name, sink, plot, profile, checkpointer, resume_state=None):
+        if not profile:
+            return self.run_simulation(output_file_name, sink, plot, checkpointer, resume_state)
+
+        profiler = profile if isinstance(profile, profiling.Profiler) else profiling.Profiler()
+        with profiler:
+            error_mic = self.run_simulation(output_file_name, sink, plot, checkpointer, resume_state)
+        info = {"simulation": type(self).__name__, "controller": self.controller.name, "block_size": self.run_block_size()}
+        self.profile_report = profiler.report(self.n, **info)
+        profiler.write_json(f"{output_file_name}-profile.json", self.n, **info)
+        return error_mic
+
+    # State of the run after position samples, for a checkpoint written to checkpoint_file
+    def checkpoint_state(self, position, monitor, sink, checkpoint_file=None):
+        state = checkpoint.combine(controller=self.controller.get_state(), plant=checkpoint.object_state(self.plant),
+                                   monitor=checkpoint.object_state(monitor), sink=sink.get_state(checkpoint_file))
+        state.update({"simulation/name": np.array(type(self).__name__), "simulation/n": np.array(self.n),
+                      "simulation/channels": np.array(self.channels), "simulation/position": np.array(position)})
+        return state
+
+    def run_simulation(self, output_file_name, sink, plot, checkpointer=None, resume_state=None):
+        profiler = profiling.current()
+
+        write_output = sink is None
+        if write_output:
+            sink = ArraySink()
+
+        self.plant.reset()
+        monitor = self.create_monitor()
+        position = 0
+        if resume_state is None:
+            print(f"Simulating for {self.n} timesteps with {self.controller.name}")
+            sink.open(self.n, self.fs, self.channels)
+        else:
+            position = int(resume_state["simulation/position"])
+            print(f"Resuming at timestep {position} of {self.n} with {self.controller.name}")
+            checkpoint.restore_object_state(self.plant, checkpoint.part(resume_state, "plant"))
+            checkpoint.restore_object_state(monitor, checkpoint.part(resume_state, "monitor"))
+            sink.reopen(self.n, self.fs, self.channels, checkpoint.part(resume_state, "sink"), checkpointer.file_path)
+
+        frames = self.source.frames(self.run_block_size(), position)
+        while True:
+            with profiler.stage("source"):
+                frame = next(frames, None)
+            if frame is None:
+                break
+            inp, reference = frame
+            position += len(inp)
+
+            # Safety should always be satisfied if Python is deterministic ;)
+            safety_is_satisfied = False
+
+            error_microphone, noise = self.step(inp, reference)
+            safety_is_satisfied = True
+            with profiler.stage("sink"):
+                sink.write(error_microphone)
+
+            # Monitor for liveness, and accumulate the squared error
+            with profiler.stage("monitor"):
+                monitor.update(error_microphone, reference, noise)
+
+            # Double check safety monitor
+            if not safety_is_satisfied:
+                print(f"Safety was not satisfied while simulating for {self.controller.name}, stopping simulation")
+                break
+
+            if checkpointer is not None and checkpointer.due():
+                with profiler.stage("checkpoint"):
+                    checkpointer.write(self.checkpoint_state(position, monitor, sink, checkpointer.file_path))
+
+        if checkpointer is not None:
+            with profiler.stage("checkpoint"):
+                checkpointer.write(self.checkpoint_state(position, monitor, sink, checkpointer.file_path))
+
+        with profiler.stage("sink"):
+            error_mic = sink.close()
+
+        # Write output
+        if write_output:
+            with profiler.stage("write_output"):
+                wav.write(f"{output_file_name}.wav", self.fs, error_mic)
+
+        # Generate plots, if the sink kept the signal
+        error_signal = sink.signal() if plot else None
+        if error_signal is not None:
+            with profiler.stage("plot"):
+                self.plot_errors(error_signal, output_file_name)
+
+        # Report monitor findings
+        self.liveness_is_satisfied = monitor.liveness_is_satisfied
+        if self.liveness_is_satisfied:
+            print(f"Liveness was satisfied for Controller : {self.controller.name}")
+        else:
+            print(f"Liveness was NOT satisfied for Controller : {self.controller.name}")
+
+        # Set MSE between error_mic and the target (the reference signal, or silence without one)
+        self.mse = monitor.mse
+        self.attenuation_db = monitor.attenuation_db
+        print(f"MSE for {self.controller.name} was {self.mse}")
+
+        return error_mic
+
+    # Real-time streaming step, runs the simulation against a loopback audio device (see realtime.py)
+    #   - block_size: samples per device block, defaults to the simulation's block_size
+    #   - deadline: time every block has to be processed in after it arrives (in seconds), defaults to one block
+    #   - paced: wait for every block on the wall clock schedule at fs. Otherwise blocks are processed back to back,
+    #     and the report is computed as if they had arrived on schedule
+    #   - sink: OutputSink for the error microphone signal, written to output_file_name.wav by default
+    #   - channel_threads: with multichannel recordings, threads processing the channels in parallel
+    #   - warm_up: warm the controller up before the device starts capturing (see warm_up()), so the first blocks
+    #     don't pay for loading and compiling it
+    # Returns the RealTimeReport of the run
+    def stream(self, output_file_name="output", new_controller=None, block_size=None, deadline=None, paced=True, sink=None,
+               channel_threads=None, warm_up=True):
+        if new_controller != None:
+            self.controller = new_controller
+        self.controller = self.channel_controller(self.controller, channel_threads)
+        block_size = block_size if block_size is not None else self.block_size
+        sink = sink if sink is not None else WavSink(f"{output_file_name}.wav")
+
+        print(f"Streaming for {self.n} timesteps with {self.controller.name} in blocks of {block_size}")
+
+        device = LoopbackDevice(self.source, block_size, sink, paced)
+        report = RealTimeReport(self.fs, block_size, deadline)
+        self.plant.reset()
+        monitor = self.create_monitor()
+
+        if warm_up:
+            report.warm_up_time = self.warm_up(block_size)
+
+        device.open()
+        for inp, reference, arrival in device.capture():
+            start = device.now() if paced else max(arrival, report.last_finish)
+            start_time = time.perf_counter()
+            error_microphone, noise = self.step(inp, reference)
+            device.play(error_microphone)
+            processing_time = time.perf_counter() - start_time
+            report.record(len(inp), arrival, start, start + processing_time)
+
+            monitor.update(error_microphone, reference, noise)
+        device.close()
+
+        self.liveness_is_satisfied = monitor.liveness_is_satisfied
+        self.mse = monitor.mse
+        self.attenuation_db = monitor.attenuation_db
+        self.realtime_report = report
+        report.print_report()
+        return report
+
+    # Run a block of silence through copies of the controller and plant, so loading and compiling (e.g. the Numba
+    # kernels of the native engine) is done before a stream starts instead of in its first blocks. The controller
+    # and plant themselves are left as they were. Returns the time it took, in seconds
+    def warm_up(self, block_size):
+        start_time = time.perf_counter()
+        controller, plant = self.controller, self.plant
+        self.controller, self.plant = copy.deepcopy(controller), copy.deepcopy(plant)
+        try:
+            silence = np.zeros((block_size,) if self.channels == 1 else (block_size, self.channels))
+            self.step(silence, silence)
+        finally:
+            self.controller, self.plant = controller, plant
+        return time.perf_counter() - start_time
+
+    # Plot the error microphone signal, implemented by the simulations
+    def plot_errors(self, error, output_file_name):
+        pass
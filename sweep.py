@@ -0,0 +1,269 @@
+import itertools
+import math
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from controllers import engine
+from wav_source import WavSource
+from monitor import reference_ratio, input_ratio
+
+# Hyperparameter Sweep -
+#   - Searches the filter_size, mu (step size, or forgetting factor for RLS), eps and w parameters of the
+#     LMS, NLMS and RLS controllers over one or more scenarios (see comparison.py), ranking every candidate
+#
+# Candidates are plain dictionaries of controller constructor arguments, so the best one can be built with
+# e.g. LMS("Tuned LMS", **leaderboard[0]["params"]). They are generated by grid() or random_candidates() and
+# evaluated by sweep() (every candidate over the whole recording) or successive_halving() (all candidates over
+# a short part of the recording, then only the best ones over longer and longer parts).
+#
+# Instead of one simulation per candidate, all candidates of a family with the same filter length are run
+# over the recording together, in one batched pass of the native engine (see controllers/engine.py), and the
+# batches are spread over a pool of worker processes. The running MSE (or the liveness metric over the last
+# monitor window) of every candidate is checked every check_every samples, and candidates that are clearly
+# worse than the best one so far (stop_ratio times worse) or have diverged are stopped early.
+#
+# The signals are the same as in the simulations: the controller is fed the noise (plus the reference for
+# Referenceful), and the MSE is measured between the error microphone and the reference for Referenceful,
+# and of the error microphone itself for Referenceless and Filtered.
+
+FAMILIES = ["LMS", "NLMS", "RLS"]
+
+# Constructor defaults of the controllers
+DEFAULTS = {
+    "LMS": {"filter_size": 5, "mu": 0.1, "w": "random"},
+    "NLMS": {"filter_size": 10, "mu": 0.05, "eps": 0.001, "w": "random"},
+    "RLS": {"filter_size": 4, "mu": 0.9, "eps": 0.001, "w": "random"},
+}
+
+# Liveness monitor of the simulations
+MONITOR_WINDOW_SIZE = 1000
+
+
+# Every combination of the given parameter values, e.g. grid(mu=[0.01, 0.1], filter_size=[4, 8])
+def grid(**space):
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+# num_candidates random parameter settings. Every parameter of space is either a list of values to choose
+# from, or a (low, high) tuple to draw uniformly from (integers if both bounds are integers)
+#   - log_scale: names of (low, high) parameters drawn uniformly on a log scale, such as mu
+def random_candidates(space, num_candidates, log_scale=("mu", "eps"), seed=0):
+    rng = np.random.default_rng(seed)
+    candidates = []
+    for _ in range(num_candidates):
+        candidate = {}
+        for name, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(low, int) and isinstance(high, int):
+                    candidate[name] = int(rng.integers(low, high + 1))
+                elif name in log_scale:
+                    candidate[name] = float(math.exp(rng.uniform(math.log(low), math.log(high))))
+                else:
+                    candidate[name] = float(rng.uniform(low, high))
+            else:
+                candidate[name] = values[rng.integers(len(values))]
+        candidates.append(candidate)
+    return candidates
+
+
+# Run one batch of candidates of a family (all with the same filter_size and w) over a scenario
+# Returns one result per candidate, in order
+#   - num_samples: only evaluate the first num_samples samples of the scenario (all of them if None)
+#   - incumbent: metric value of the best candidate found so far elsewhere (for early stopping)
+def evaluate_batch(scenario, family, candidates, peaks, num_samples=None, check_every=20000, stop_ratio=2.0,
+                   min_samples=20000, metric="mse", incumbent=None, seed=0):
+    params = [dict(DEFAULTS[family], **candidate) for candidate in candidates]
+    filter_size = params[0]["filter_size"]
+    K = len(params)
+
+    # Every candidate starts from the same weights, so they only differ by their parameters
+    np.random.seed(seed)
+    W = np.array([engine.init_weights(params[0]["w"], filter_size)] * K)
+    mu = np.array([p["mu"] for p in params], dtype=float)
+    eps = np.array([p.get("eps", 0.0) for p in params], dtype=float)
+    if family == "RLS":
+        R = np.array([1 / p["eps"] * np.identity(filter_size) for p in params])
+    taps = np.zeros(2 * filter_size)
+    position = 0
+
+    referenceful = scenario.simulation == "referenceful"
+    feed = {"referenceful": engine.FEED_REFERENCE, "referenceless": engine.FEED_ERROR, "filtered": engine.FEED_NONE}[scenario.simulation]
+
+    noise_source = WavSource(scenario.noise_file_path, scenario.num_timesteps, peak=peaks[scenario.noise_file_path],
+                             cache=scenario.cache)
+    n = len(noise_source)
+    if referenceful:
+        reference_source = WavSource(scenario.reference_file_path, scenario.num_timesteps,
+                                     peak=peaks[scenario.reference_file_path], cache=scenario.cache)
+        n = min(n, len(reference_source))
+        if reference_source.channels > 1:
+            raise ValueError(f"Sweeps only support single channel recordings, {scenario.reference_file_path} has {reference_source.channels}")
+    if noise_source.channels > 1:
+        raise ValueError(f"Sweeps only support single channel recordings, {scenario.noise_file_path} has {noise_source.channels}")
+    if num_samples is not None:
+        n = min(n, num_samples)
+
+    # Candidates still running (indices into params), and their running totals
+    alive = np.arange(K)
+    squared_error = np.zeros(K)
+    liveness = np.full(K, np.nan)
+    samples = np.zeros(K, dtype=int)
+    stopped = np.zeros(K, dtype=bool)
+
+    for start in range(0, n, check_every):
+        stop = min(start + check_every, n)
+        noise = noise_source.read(start, stop)
+        reference = reference_source.read(start, stop) if referenceful else noise
+        inp = noise + reference if referenceful else noise
+
+        if family == "RLS":
+            output, position = engine.rls_run_batch(inp, reference, feed, W, R, taps, position, mu)
+        else:
+            output, position = engine.lms_run_batch(inp, reference, feed, W, taps, position, mu, eps, family == "NLMS")
+        error = inp + output
+
+        # MSE and liveness metric (over the last monitor window) of the simulations
+        # (diverging candidates overflow here, they are stopped below)
+        window = slice(max(0, len(inp) - MONITOR_WINDOW_SIZE), len(inp))
+        with np.errstate(all="ignore"):
+            if referenceful:
+                squared_error[alive] += np.sum(np.square(reference - error), axis=1)
+                values = reference_ratio(error[:, window], reference[window], inp[window])
+            else:
+                squared_error[alive] += np.sum(np.square(error), axis=1)
+                values = input_ratio(error[:, window], None, inp[window])
+        liveness[alive] = np.mean(values, axis=1)
+        samples[alive] = stop
+
+        # Early stopping - drop diverged candidates, and ones clearly worse than the best so far
+        if stop >= n:
+            break
+        scores = squared_error[alive] / stop if metric == "mse" else liveness[alive]
+        keep = np.isfinite(scores)
+        if stop >= min_samples and np.any(keep):
+            best = np.min(scores[keep]) if incumbent is None else min(np.min(scores[keep]), incumbent)
+            keep &= scores <= stop_ratio * best
+        if not np.all(keep):
+            stopped[alive[~keep]] = True
+            alive = alive[keep]
+            W, mu, eps = W[keep], mu[keep], eps[keep]
+            if family == "RLS":
+                R = R[keep]
+            if len(alive) == 0:
+                break
+
+    results = []
+    for k in range(K):
+        results.append({
+            "scenario": scenario.name,
+            "family": family,
+            "params": params[k],
+            "mse": squared_error[k] / samples[k] if samples[k] > 0 else float("inf"),
+            "liveness": liveness[k],
+            "samples": int(samples[k]),
+            "stopped": bool(stopped[k]),
+        })
+    return results
+
+
+# Split candidates into batches that can run together (same filter length and initial weights)
+def batches(family, candidates, batch_size):
+    groups = {}
+    for candidate in candidates:
+        params = dict(DEFAULTS[family], **candidate)
+        w = params["w"]
+        key = (params["filter_size"], w if isinstance(w, str) else tuple(w))
+        groups.setdefault(key, []).append(candidate)
+    for group in groups.values():
+        for start in range(0, len(group), batch_size):
+            yield group[start:start + batch_size]
+
+
+# Rank results, candidates that ran to the end by metric first, then the stopped ones by how far they got
+def rank(results, metric="mse"):
+    def key(result):
+        score = result["mse"] if metric == "mse" else result["liveness"]
+        return (result["stopped"], -result["samples"], score if np.isfinite(score) else float("inf"))
+    return sorted(results, key=key)
+
+
+# Normalization peaks of the scenarios' wav files, found once for every run
+def find_peaks(scenarios):
+    peaks = {}
+    for scenario in scenarios:
+        for file_path in (scenario.noise_file_path, scenario.reference_file_path):
+            if file_path is not None and file_path not in peaks:
+                peaks[file_path] = WavSource(file_path).peak
+    return peaks
+
+
+def _evaluate_all(executor, scenarios, family, candidates, peaks, batch_size, incumbents=None, **options):
+    futures = []
+    for scenario in scenarios:
+        incumbent = incumbents.get(scenario.name) if incumbents else None
+        for batch in batches(family, candidates[scenario.name], batch_size):
+            futures.append(executor.submit(evaluate_batch, scenario, family, batch, peaks, incumbent=incumbent, **options))
+    results = {scenario.name: [] for scenario in scenarios}
+    for future in futures:
+        for result in future.result():
+            results[result["scenario"]].append(result)
+    return results
+
+
+# Evaluate every candidate over every scenario, returning a ranked leaderboard per scenario name
+#   - family: "LMS", "NLMS" or "RLS"
+#   - candidates: list of parameter dictionaries, from grid() or random_candidates()
+#   - processes: number of worker processes, defaults to the number of CPUs
+#   - batch_size: maximum number of candidates run together in one batched pass
+#   - check_every, stop_ratio, min_samples, metric ("mse" or "liveness"), seed: see evaluate_batch()
+def sweep(scenarios, family, candidates, processes=None, batch_size=64, **options):
+    if family not in FAMILIES:
+        raise ValueError(f"Unknown family {family}, expected one of {FAMILIES}")
+    metric = options.get("metric", "mse")
+    peaks = find_peaks(scenarios)
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        results = _evaluate_all(executor, scenarios, family, {s.name: candidates for s in scenarios}, peaks, batch_size, **options)
+    return {name: rank(scenario_results, metric) for name, scenario_results in results.items()}
+
+
+# Successive halving - evaluate every candidate over the first part of the recording, keep the best
+# 1/eta of them and evaluate those over eta times more samples, until the survivors run over the whole
+# recording. Returns a ranked leaderboard per scenario name, where candidates dropped in earlier rounds
+# are ranked after the ones that got further
+#   - min_budget: number of samples of the first round
+def successive_halving(scenarios, family, candidates, min_budget=20000, eta=3, processes=None, batch_size=64, **options):
+    if family not in FAMILIES:
+        raise ValueError(f"Unknown family {family}, expected one of {FAMILIES}")
+    metric = options.get("metric", "mse")
+    peaks = find_peaks(scenarios)
+
+    survivors = {scenario.name: list(candidates) for scenario in scenarios}
+    eliminated = {scenario.name: [] for scenario in scenarios}
+    leaderboards = {}
+    budget = min_budget
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        while True:
+            last_round = all(budget >= scenario.num_timesteps for scenario in scenarios) or all(len(s) <= 1 for s in survivors.values())
+            num_samples = None if last_round else budget
+            results = _evaluate_all(executor, scenarios, family, survivors, peaks, batch_size,
+                                    num_samples=num_samples, **options)
+            for scenario in scenarios:
+                ranked = rank(results[scenario.name], metric)
+                if last_round:
+                    leaderboards[scenario.name] = ranked + eliminated[scenario.name]
+                    continue
+                keep = max(1, len(ranked) // eta)
+                survivors[scenario.name] = [result["params"] for result in ranked[:keep]]
+                eliminated[scenario.name] = ranked[keep:] + eliminated[scenario.name]
+            if last_round:
+                return leaderboards
+            budget *= eta
+
+
+# Print a leaderboard as a table
+def print_leaderboard(leaderboard, top=10):
+    print(f"{'rank':>4} {'params':<60} {'mse':>12} {'liveness':>10} {'samples':>9} {'stopped':>8}")
+    for i, result in enumerate(leaderboard[:top]):
+        params = ", ".join(f"{name}={value}" for name, value in result["params"].items())
+        print(f"{i + 1:>4} {params:<60} {result['mse']:>12.6g} {result['liveness']:>10.4g} {result['samples']:>9} {str(result['stopped']):>8}")
@@ -0,0 +1,76 @@
+import numpy as np
+import scipy.io.wavfile as wav
+import signal_cache
+
+# Wav Source -
+#   - Streams the samples of a wav file into a simulation without loading the whole file
+#
+# The wav file is memory-mapped, so samples are only read from disk when a frame is requested.
+# Samples are scaled from -1 to 1 by the peak absolute value of the file, which is either supplied
+# (for example when it is already known from an earlier run) or found in one chunked pass over the
+# file. Either way, the memory used does not depend on the length of the recording.
+#
+# Multichannel files keep their (n, channels) layout, so frames of a stereo file are (frame_size, 2) arrays and
+# every channel is normalized by the peak of the whole file. Mono files give one dimensional frames.
+#
+# With a signal cache (see signal_cache.py), the file is instead decoded and normalized once, and the normalized
+# float32 signal is kept in memory and memory-mapped from disk by every later WavSource of the same file.
+class WavSource:
+
+    # Constructor
+    #   - num_timesteps: only stream the first num_timesteps samples (all of them if None)
+    #   - peak: peak absolute value used to normalize the file, found from the file if None
+    #   - chunk_size: number of samples read from the file at a time
+    #   - cache: SignalCache to load the normalized signal from, True for the default cache, or None to stream the file
+    def __init__(self, file_path, num_timesteps=None, peak=None, chunk_size=65536, cache=None):
+        self.file_path = file_path
+        self.chunk_size = chunk_size
+
+        if cache:
+            cache = signal_cache.default_cache() if cache is True else cache
+            self.fs, self.data, self.peak = cache.load(self.file_path, peak=peak)
+            self.normalized = True
+            self.channels = 1 if self.data.ndim == 1 else self.data.shape[1]
+            self.n = len(self.data) if num_timesteps is None else min(num_timesteps, len(self.data))
+            return
+        self.normalized = False
+
+        try:
+            self.fs, self.data = wav.read(self.file_path, mmap=True)
+        except ValueError:
+            # Some formats (e.g. 24 bit) can't be memory-mapped, so they have to be read in full
+            self.fs, self.data = wav.read(self.file_path)
+
+        # Number of channels, the samples of multichannel files are (n, channels) arrays
+        self.channels = 1 if self.data.ndim == 1 else self.data.shape[1]
+
+        self.peak = peak if peak is not None else self.find_peak()
+        self.n = len(self.data) if num_timesteps is None else min(num_timesteps, len(self.data))
+
+    def __len__(self):
+        return self.n
+
+    # Peak absolute value of the whole file, computed one chunk at a time
+    def find_peak(self):
+        peak = 0.0
+        for start in range(0, len(self.data), self.chunk_size):
+            chunk = np.asarray(self.data[start:start + self.chunk_size], dtype=np.float64)
+            peak = max(peak, np.max(np.abs(chunk)))
+        return peak
+
+    # Normalized samples from start to stop
+    def read(self, start=0, stop=None):
+        stop = self.n if stop is None else min(stop, self.n)
+        if self.normalized:
+            return np.asarray(self.data[start:stop], dtype=np.float64)
+        return self.data[start:stop] / self.peak
+
+    # Lazily yield consecutive normalized frames of frame_size samples from start to stop (the last one may be shorter)
+    # Samples are read from the file a chunk at a time, then split into frames
+    def frames(self, frame_size, start=0, stop=None):
+        stop = self.n if stop is None else min(stop, self.n)
+        chunk_size = max(frame_size, self.chunk_size // frame_size * frame_size)
+        for chunk_start in range(start, stop, chunk_size):
+            chunk = self.read(chunk_start, min(chunk_start + chunk_size, stop))
+            for frame_start in range(0, len(chunk), frame_size):
+                yield chunk[frame_start:frame_start + frame_size]